@@ -1,35 +1,264 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, Response, render_template, request, jsonify
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 import os
+import signal
+import json
+import logging
+import queue
 import tempfile
-import yt_dlp
 import re
 import uuid
+import time
 from urllib.parse import urlparse
-import random
+import threading
 import config
+import ytdl
+from info_cache import InfoCache, normalize_url
+from download_queue import DownloadQueue, QueueFull
+from dedup import ArtifactIndex, DedupStats, SingleFlight, make_key
+from task_store import FINAL_STATUSES, create_task_store
+from progress_events import ProgressBroker
+from progress import ProgressTracker
+from formats import apply_audio_plan, apply_plan, audio_postprocessors, build_ladder, plan_audio, plan_output
+from modes import (AUDIO_FORMAT, InvalidMode, apply_clip, check_clip, expected_size, is_audio, mode_key,
+                   parse_mode)
+from streaming import MuxStream, StreamingUnavailable, check_streamable
+from proxies import ProxyPool, is_proxy_error, proxy_label
+from storage import PARTIAL_SUFFIXES, ArtifactStore
+from extraction import ExtractionBusy, ExtractionPool, ExtractionTimeout
+from retries import EXPIRED, FATAL, FORMAT, NETWORK, POSTPROCESS, OutputMissing, RetryBudget, classify
+from concurrent.futures import CancelledError
+from serving import attachment_header, iter_zip, send_file_offload, send_file_range
+from metrics import (CONTENT_TYPE as METRICS_CONTENT_TYPE, EXTRACTION_BUCKETS, POSTPROCESS_BUCKETS,
+                     TASK_BUCKETS, THROUGHPUT_BUCKETS, Registry)
+
+logging.basicConfig(level=config.LOG_LEVEL, format=config.LOG_FORMAT)
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
 
-# Dictionary to store download status
-download_tasks = {}
+# Where finished downloads are stored - use absolute path to avoid issues
+DOWNLOADS_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'downloads')
+
+# Download status, shared by all server processes when a shared backend is configured
+task_store = create_task_store(
+    config.TASK_STORE,
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), config.TASK_STORE_PATH),
+    ttl=config.TASK_TTL,
+    max_entries=config.TASK_MAX_ENTRIES,
+)
+
+# Bounds the number of ffmpeg processes muxing straight to a client
+stream_slots = threading.BoundedSemaphore(config.STREAM_MAX_CONCURRENT)
+
+# Bounds the number of connections held by progress streams; gunicorn
+# workers size it from their connections or threads (size_progress_streams)
+sse_capacity = config.SSE_MAX_CONNECTIONS or 100
+sse_slots = threading.BoundedSemaphore(sse_capacity)
+
+# Bounds the number of request threads waiting on extractions
+extraction_waiters = threading.BoundedSemaphore(config.EXTRACTION_WAITERS)
+
+# Per-chunk progress counters of running downloads; the task store only
+# sees the rate-limited summary
+progress_trackers = {}
+
+# Running downloads of this process that the user asked to stop
+cancelled_tasks = set()
+
+# Wakes up the progress streams of a task whenever it is updated
+progress_broker = ProgressBroker()
+
+# Extracted metadata shared by get-info, download and the download thread
+info_cache = InfoCache(config.INFO_CACHE_TTL, config.INFO_CACHE_MAX_ENTRIES)
+
+# Runs yt-dlp extractions so request threads never block on them for long
+extraction_pool = ExtractionPool(
+    config.EXTRACTION_WORKERS,
+    config.EXTRACTION_QUEUE_SIZE,
+    config.EXTRACTION_DEADLINE,
+    job_ttl=config.EXTRACTION_JOB_TTL,
+)
+
+# Fixed-size pool that runs download_thread jobs
+download_queue = DownloadQueue(config.DOWNLOAD_WORKERS, config.DOWNLOAD_QUEUE_SIZE, config.DOWNLOADS_PER_HOST)
+
+# Identical requests share one running download or one finished file
+artifact_index = ArtifactIndex(os.path.join(DOWNLOADS_DIR, 'artifacts.json'), config.ARTIFACT_TTL)
+inflight_downloads = SingleFlight()
+dedup_stats = DedupStats()
+
+# Keeps the downloads directory under its byte budget
+storage = ArtifactStore(
+    DOWNLOADS_DIR,
+    config.STORAGE_BUDGET_BYTES,
+    config.STORAGE_FILE_TTL,
+    partial_grace=config.STORAGE_PARTIAL_GRACE,
+    keep=('artifacts.json', os.path.basename(config.TASK_STORE_PATH)),
+    scan_interval=config.STORAGE_SCAN_INTERVAL,
+)
+
+# Scores proxies by success rate and latency and quarantines dead ones
+proxy_pool = ProxyPool(
+    config.PROXY_LIST,
+    groups=config.PROXY_GROUPS,
+    affinity=config.PROXY_AFFINITY,
+    quarantine_base=config.PROXY_QUARANTINE_BASE,
+    quarantine_max=config.PROXY_QUARANTINE_MAX,
+    probe_url=config.PROXY_PROBE_URL,
+    probe_interval=config.PROXY_PROBE_INTERVAL,
+    probe_timeout=config.PROXY_PROBE_TIMEOUT,
+)
+
+# Per-phase timings and server state exposed on /metrics
+metrics = Registry('videofetcher_')
+extraction_seconds = metrics.histogram(
+    'extraction_seconds', 'Time spent extracting metadata with yt-dlp',
+    ('platform', 'proxy', 'outcome'), EXTRACTION_BUCKETS)
+transfer_throughput = metrics.histogram(
+    'transfer_bytes_per_second', 'Media transfer rate of finished downloads',
+    ('platform', 'proxy'), THROUGHPUT_BUCKETS)
+merge_seconds = metrics.histogram(
+    'merge_seconds', 'Time ffmpeg spent merging video and audio',
+    ('platform', 'proxy'), POSTPROCESS_BUCKETS)
+queue_wait_seconds = metrics.histogram(
+    'queue_wait_seconds', 'Time downloads waited for a worker',
+    ('platform',), TASK_BUCKETS)
+task_seconds = metrics.histogram(
+    'task_seconds', 'Time from submitting a download to its final status',
+    ('platform', 'proxy', 'status'), TASK_BUCKETS)
+download_retries = metrics.counter('download_retries_total', 'Download retries by failure kind', ('reason',))
+bytes_served = metrics.counter('bytes_served_total', 'Bytes of downloaded files sent to clients', ('route',))
+queue_depth = metrics.gauge('queue_depth', 'Downloads waiting for a worker')
+active_workers = metrics.gauge('active_workers', 'Workers busy per pool', ('pool',))
+worker_slots = metrics.gauge('worker_slots', 'Workers configured per pool', ('pool',))
+cache_lookups = metrics.counter('cache_lookups_total', 'Cache lookups by cache and result', ('cache', 'result'))
+dedup_outcomes = metrics.counter('dedup_requests_total', 'Download requests by how they were served', ('outcome',))
+storage_bytes = metrics.gauge('storage_bytes', 'Bytes stored in the downloads directory')
+storage_removals = metrics.counter('storage_removals_total', 'Files deleted from the downloads directory', ('reason',))
+proxy_score = metrics.gauge('proxy_score', 'Current selection score of each proxy', ('proxy',))
+proxy_quarantined = metrics.gauge('proxy_quarantined', '1 while a proxy is quarantined', ('proxy',))
 
-def get_random_proxy():
-    """Return a random proxy from the list, or None if proxy usage is disabled"""
+def choose_proxy(platform=None, exclude=()):
+    """Return a healthy proxy from the pool, or None if proxy usage is disabled"""
     if not config.USE_PROXY or not config.PROXY_LIST:
         return None
-    return random.choice(config.PROXY_LIST)
+    return proxy_pool.choose(platform, exclude)
 
-def apply_proxy_settings(ydl_opts):
+def apply_proxy_settings(ydl_opts, platform=None, exclude=()):
     """Apply proxy settings to a yt-dlp options dictionary if enabled"""
     if config.USE_PROXY:
-        proxy = get_random_proxy()
+        proxy = choose_proxy(platform, exclude)
         if proxy:
             ydl_opts['proxy'] = proxy
             ydl_opts['socket_timeout'] = config.SOCKET_TIMEOUT
             return proxy
     return None
 
+def update_task(task_id, **fields):
+    """Write task fields and notify anyone streaming that task's progress"""
+    task_store.update(task_id, **fields)
+    progress_broker.publish(task_id, fields)
+
+def extract_video_info(url, ydl_opts=None):
+    """Return (info, proxy) for a URL, running yt-dlp extraction only on a cache miss"""
+    info, proxy = info_cache.get(url)
+    if info is not None:
+        log.debug("Metadata cache hit for: %s", url)
+        return info, proxy
+
+    # Retry on a different proxy when the failure looks like the proxy's fault
+    platform = get_platform(url)
+    tried = []
+    attempts = max(1, config.PROXY_MAX_ATTEMPTS)
+    for attempt in range(1, attempts + 1):
+        opts = dict(ydl_opts or {'quiet': True})
+        proxy = apply_proxy_settings(opts, platform, tried)
+        started = time.monotonic()
+        try:
+            with ytdl.pool.borrow(opts) as ydl:
+                log.info("Extracting info for: %s (proxy: %s)", url, proxy_label(proxy))
+                info = ydl.extract_info(url, download=False)
+        except Exception as e:
+            extraction_seconds.observe(time.monotonic() - started, platform=platform,
+                                       proxy=proxy_label(proxy), outcome='error')
+            if not proxy or not is_proxy_error(e):
+                raise
+            proxy_pool.report_failure(proxy)
+            if attempt == attempts:
+                raise
+            tried.append(proxy)
+            log.warning("Extraction through %s failed, retrying with another proxy: %s", proxy_label(proxy), e)
+            continue
+        
+        extraction_seconds.observe(time.monotonic() - started, platform=platform, proxy=proxy_label(proxy),
+                                   outcome='ok' if info is not None else 'empty')
+        if proxy:
+            if info is None and attempt < attempts:
+                # With ignoreerrors the failure only shows up as a missing result
+                proxy_pool.report_failure(proxy)
+                tried.append(proxy)
+                continue
+            if info is not None:
+                proxy_pool.report_success(proxy, time.monotonic() - started)
+        return info_cache.put(url, info, proxy), proxy
+
+def start_extraction(url, ydl_opts=None):
+    """Start extract_video_info on the extraction pool, or join the job already running for url"""
+    return extraction_pool.submit(normalize_url(url), extract_video_info, url, ydl_opts)
+
+def wait_for_extraction(job, wait):
+    """extraction_pool.wait for up to wait seconds if a waiter slot is free;
+    otherwise only a finished job's result (None while it runs)"""
+    if job.future.done() or not extraction_waiters.acquire(blocking=False):
+        return extraction_pool.wait(job, 0)
+    try:
+        return extraction_pool.wait(job, wait)
+    finally:
+        extraction_waiters.release()
+
+def extract_with_deadline(url, ydl_opts=None):
+    """extract_video_info on the extraction pool, giving up at the job's deadline"""
+    info, proxy = info_cache.get(url)
+    if info is not None:
+        return info, proxy
+    return extraction_pool.wait(start_extraction(url, ydl_opts))
+
+def format_ladder(url, info):
+    """Quality options for a URL, built once per cached info dict"""
+    ladder = info_cache.get_plan(url, 'ladder')
+    if ladder is None:
+        ladder = build_ladder(info)
+        info_cache.put_plan(url, 'ladder', ladder)
+    return ladder
+
+def output_plan(url, info, format_spec, mode=None):
+    """plan_output() or plan_audio() for a URL, cached next to its metadata per format selector"""
+    if is_audio(mode):
+        container = mode['audio_format']
+        plan_key = f"{format_spec}|audio:{container or 'native'}"
+        plan = info_cache.get_plan(url, plan_key)
+        if plan is None:
+            plan = plan_audio(info, format_spec, container)
+            info_cache.put_plan(url, plan_key, plan)
+        return plan
+    plan = info_cache.get_plan(url, format_spec)
+    if plan is None:
+        plan = plan_output(info, format_spec)
+        info_cache.put_plan(url, format_spec, plan)
+    return plan
+
+def dedup_key_for(url, info, format_spec, mode=None):
+    """make_key() using the cached output plan to resolve the format"""
+    format_ids = None
+    if info:
+        try:
+            format_ids = output_plan(url, info, format_spec, mode)['format_id']
+        except Exception as e:
+            log.warning("Could not resolve format %s: %s", format_spec, e)
+    return make_key(url, info, format_spec, format_ids, mode_key(mode))
+
 def is_valid_url(url):
     try:
         result = urlparse(url)
@@ -58,67 +287,6 @@ def get_platform(url):
     else:
         return "unknown"
 
-def get_available_formats(url):
-    try:
-        ydl_opts = {'quiet': True}
-        proxy = apply_proxy_settings(ydl_opts)
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            formats = []
-            
-            # Always add a "best" option first
-            formats.append({
-                'format_id': 'bestvideo+bestaudio/best',
-                'label': 'Best quality'
-            })
-            
-            # Define formats that ensure both video and audio
-            format_options = [
-                {'height': 360, 'format_id': 'bestvideo[height<=360]+bestaudio/best[height<=360]', 'label': '360p'},
-                {'height': 480, 'format_id': 'bestvideo[height<=480]+bestaudio/best[height<=480]', 'label': '480p'},
-                {'height': 720, 'format_id': 'bestvideo[height<=720]+bestaudio/best[height<=720]', 'label': '720p'},
-                {'height': 1080, 'format_id': 'bestvideo[height<=1080]+bestaudio/best[height<=1080]', 'label': '1080p'}
-            ]
-            
-            # Add formats based on what's available
-            available_heights = set()
-            for f in info.get('formats', []):
-                if f.get('height') and f.get('height') > 0:
-                    available_heights.add(f.get('height'))
-            
-            print(f"Available heights: {available_heights}")
-            
-            if not available_heights:
-                # If no heights available, offer all standard options
-                for option in format_options:
-                    formats.append({
-                        'format_id': option['format_id'],
-                        'label': option['label']
-                    })
-            else:
-                # Offer only resolutions that are available (or lower)
-                for option in format_options:
-                    # Check if this or any lower resolution is available
-                    matching_heights = [h for h in available_heights if h <= option['height']]
-                    if matching_heights:
-                        formats.append({
-                            'format_id': option['format_id'],
-                            'label': option['label']
-                        })
-            
-            return formats
-    except Exception as e:
-        print(f"Error in format selection: {str(e)}")
-        # Fallback to basic formats in case of error
-        return [
-            {'format_id': 'bestvideo+bestaudio/best', 'label': 'Best quality'},
-            {'format_id': 'bestvideo[height<=360]+bestaudio/best', 'label': '360p'},
-            {'format_id': 'bestvideo[height<=480]+bestaudio/best', 'label': '480p'},
-            {'format_id': 'bestvideo[height<=720]+bestaudio/best', 'label': '720p'},
-            {'format_id': 'bestvideo[height<=1080]+bestaudio/best', 'label': '1080p'}
-        ]
-
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -134,75 +302,100 @@ def get_info():
     if platform == "unknown":
         return jsonify({"status": "error", "message": "Unsupported platform"})
     
+    # Set up options with detailed debugging
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': False,
+        'ignoreerrors': True  # Don't immediately fail on errors
+    }
+    
     try:
-        # Set up options with detailed debugging
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': False,
-            'ignoreerrors': True  # Don't immediately fail on errors
-        }
+        job = start_extraction(url, ydl_opts)
+    except ExtractionBusy as e:
+        log.warning("Rejecting get-info: %s", e)
+        return jsonify({
+            "status": "error",
+            "message": "The server is busy. Please try again in a few minutes."
+        }), 429
+    
+    # Answer right away when the extraction is quick (or is cached);
+    # otherwise the client polls /api/get-info/<job_id>
+    return info_response(url, platform, job, config.EXTRACTION_WAIT)
+
+@app.route('/api/get-info/<job_id>', methods=['GET'])
+def get_info_result(job_id):
+    job = extraction_pool.get(job_id)
+    if job is not None:
+        url = job.args[0]
+        return info_response(url, get_platform(url), job, config.EXTRACTION_POLL_WAIT)
+    
+    # The job runs in another worker process; its outcome is in the task store
+    shared = task_store.get(info_job_key(job_id))
+    if shared is None:
+        return jsonify({"status": "error", "message": "Request expired. Please check the URL again."}), 404
+    if shared['status'] != 'pending':
+        return jsonify(shared['response'])
+    if time.time() > shared['deadline']:
+        # The worker running it went away before writing the outcome
+        return jsonify({"status": "error", "message": "The video site took too long to respond. Please try again."})
+    return jsonify({"status": "pending", "job_id": job_id}), 202
+
+@app.route('/api/get-info/<job_id>', methods=['DELETE'])
+def cancel_get_info(job_id):
+    return jsonify({"status": "success", "cancelled": extraction_pool.cancel(job_id)})
+
+def info_job_key(job_id):
+    return f"get-info:{job_id}"
+
+def share_info_job(url, platform, job):
+    """Keep a pending get-info job's outcome in the task store, so polls can
+    land on any worker process"""
+    if job.shared:
+        return
+    job.shared = True
+    key = info_job_key(job.job_id)
+    remaining = max(0, job.deadline - time.monotonic())
+    task_store.create(key, {"status": "pending", "deadline": time.time() + remaining})
+    job.future.add_done_callback(
+        lambda _: task_store.update(key, status='finished', response=info_result(url, platform, job, 0))
+    )
+
+def info_response(url, platform, job, wait):
+    """Build the get-info response for an extraction job, waiting up to wait seconds"""
+    result = info_result(url, platform, job, wait)
+    if result is None:
+        share_info_job(url, platform, job)
+        return jsonify({"status": "pending", "job_id": job.job_id}), 202
+    return jsonify(result)
+
+def info_result(url, platform, job, wait):
+    """The get-info response body for an extraction job, or None while it is still running"""
+    try:
+        result = wait_for_extraction(job, wait)
+        if result is None:
+            return None
         
-        proxy = apply_proxy_settings(ydl_opts)
+        info, proxy = result
+        if not info:
+            log.warning("No info extracted for: %s", url)
+            return {"status": "error", "message": "Could not extract video information. The video might be private, removed, or region-restricted."}
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            print(f"Attempting to extract info for: {url}" + (f" using proxy: {proxy}" if proxy else ""))
-            info = ydl.extract_info(url, download=False)
-            
-            if not info:
-                print(f"No info extracted for: {url}")
-                return jsonify({"status": "error", "message": "Could not extract video information. The video might be private, removed, or region-restricted."})
-            
-            formats = []
-            
-            # Always add a "best" option first
-            formats.append({
-                'format_id': 'bestvideo+bestaudio/best',
-                'label': 'Best quality'
-            })
-            
-            # Get available heights from the video
-            available_heights = set()
-            for f in info.get('formats', []):
-                if f.get('height') and f.get('height') > 0:
-                    available_heights.add(f.get('height'))
-            
-            print(f"Available heights: {available_heights}")
-            
-            # Common resolutions to offer
-            target_heights = [360, 480, 720, 1080]
-            
-            # If there are no valid heights, offer standard options
-            if not available_heights:
-                print("No valid heights found, offering standard options")
-                for height in target_heights:
-                    formats.append({
-                        'format_id': f'bestvideo[height<={height}]+bestaudio/best[height<={height}]',
-                        'label': f"{height}p"
-                    })
-            else:
-                # Determine which resolutions are available (rounding to standard values)
-                added_heights = set()
-                for target in target_heights:
-                    # Find the closest available height that's not higher than target
-                    closest = [h for h in available_heights if h <= target]
-                    if closest:
-                        max_height = max(closest)
-                        if max_height not in added_heights:
-                            formats.append({
-                                'format_id': f'bestvideo[height<={target}]+bestaudio/best[height<={target}]',
-                                'label': f"{target}p"
-                            })
-                            added_heights.add(max_height)
-            
-            print(f"Offering formats: {formats}")
-            return jsonify({
-                "status": "success",
-                "platform": platform,
-                "formats": formats,
-                "title": info.get('title', 'Unknown Title')
-            })
+        formats = format_ladder(url, info)
+        
+        log.debug("Offering formats: %s", formats)
+        return {
+            "status": "success",
+            "platform": platform,
+            "formats": formats,
+            "title": info.get('title', 'Unknown Title')
+        }
+    except ExtractionTimeout as e:
+        log.warning("Extraction timed out for %s: %s", url, e)
+        return {"status": "error", "message": "The video site took too long to respond. Please try again."}
+    except CancelledError:
+        return {"status": "error", "message": "The request was cancelled."}
     except Exception as e:
-        print(f"Error extracting info: {str(e)}")
+        log.error("Error extracting info: %s", e)
         error_message = str(e)
         if "This video is not available" in error_message:
             error_message = "This video is not available. It may be private, removed, or region-restricted."
@@ -212,33 +405,63 @@ def get_info():
             error_message = "The URL is invalid or not supported."
         elif "Unsupported URL" in error_message:
             error_message = "This URL or platform is not supported."
-        return jsonify({"status": "error", "message": error_message})
+        return {"status": "error", "message": error_message}
+
+def ensure_audio(format_id):
+    """Always ensure we have audio"""
+    if 'bestaudio' not in format_id and '+bestaudio' not in format_id:
+        format_id = f"{format_id}+bestaudio/best"
+    return format_id
+
+def download_format(format_id, mode):
+    """The selector a download uses: the audio alone in audio-only mode, else the quality plus audio"""
+    return AUDIO_FORMAT if is_audio(mode) else ensure_audio(format_id)
+
+def fallback_format(mode):
+    """The selector a download falls back to when its format is unavailable"""
+    return AUDIO_FORMAT if is_audio(mode) else config.DEFAULT_FORMAT
 
 @app.route('/api/download', methods=['POST'])
 def download_video():
     url = request.json.get('url', '')
     format_id = request.json.get('format_id', config.DEFAULT_FORMAT)
     title = request.json.get('title', '')
+    try:
+        priority = int(request.json.get('priority', 0))
+    except (TypeError, ValueError):
+        priority = 0
     
     if not url:
         return jsonify({"status": "error", "message": "URL is required"})
     
-    # Always ensure we have audio
-    if 'bestaudio' not in format_id and '+bestaudio' not in format_id:
-        format_id = f"{format_id}+bestaudio/best"
+    # Audio only and/or a clip instead of the whole video
+    try:
+        mode = parse_mode(request.json)
+    except InvalidMode as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     
+    payload, status_code = create_download(url, download_format(format_id, mode), title, priority, mode)
+    return jsonify(payload), status_code
+
+def download_group(url):
+    """Host a download is fetched from, used for per-host concurrency limits"""
+    host = (urlparse(url).hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+def create_download(url, format_id, title='', priority=0, mode=None):
+    """Create and schedule a download task; return (response payload, HTTP status)"""
     task_id = str(uuid.uuid4())
-    download_tasks[task_id] = {
-        "status": "started", 
+    task_store.create(task_id, {
+        "status": "queued", 
         "progress": 0,
         "title": title
-    }
+    })
     
     try:
-        # Create a more reliable storage directory - use absolute path to avoid issues
-        storage_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'downloads')
+        # Create a more reliable storage directory
+        storage_dir = DOWNLOADS_DIR
         os.makedirs(storage_dir, exist_ok=True)
-        print(f"Using storage directory: {storage_dir}")
+        log.debug("Using storage directory: %s", storage_dir)
         
         # Use task_id in filename to ensure uniqueness
         output_path = os.path.join(storage_dir, f"{task_id}.%(ext)s")
@@ -247,11 +470,22 @@ def download_video():
             'format': format_id,
             'outtmpl': output_path,
             'progress_hooks': [lambda d: update_progress(task_id, d)],
+            'postprocessor_hooks': [lambda d: update_postprocess(task_id, d)],
             'merge_output_format': config.MERGE_OUTPUT_FORMAT,
             'postprocessor_args': ['-movflags', 'faststart'],  # Optimize for streaming
             'noplaylist': True,  # Only download the video, not playlists
+            # Fetch DASH/HLS fragments in parallel
+            'concurrent_fragment_downloads': config.CONCURRENT_FRAGMENTS,
             'quiet': False,
             'no_warnings': False,
+            # yt-dlp's own output goes to the log at debug level, and its
+            # per-chunk progress lines only when debug logging is on
+            'logger': logging.getLogger('yt_dlp'),
+            'noprogress': not log.isEnabledFor(logging.DEBUG),
+            # Likewise for ffmpeg when it is the downloader (clips)
+            'external_downloader_args': {
+                'ffmpeg': [] if log.isEnabledFor(logging.DEBUG) else ['-loglevel', 'error', '-nostats'],
+            },
             'ignoreerrors': False,  # Don't ignore errors during download
             # Add FFmpeg-specific options to ensure audio is included
             'postprocessors': [{
@@ -260,115 +494,266 @@ def download_video():
             }],
             # Ensure we have FFmpeg for merging
             'prefer_ffmpeg': True,
+            # Keep the local modification time; the disk budget expires
+            # files by it
+            'updatetime': False,
         }
+        if is_audio(mode):
+            # Until the output plan says otherwise, keep only the audio
+            ydl_opts['postprocessors'] = audio_postprocessors(mode['audio_format'])
+        apply_clip(ydl_opts, mode, config.CLIP_PRECISE_CUTS)
+        
+        # Reuse the metadata from /api/get-info when we have it; otherwise
+        # start extracting it now, off the request thread. The download
+        # worker picks up the result.
+        info, info_proxy = info_cache.get(url)
+        if info is None:
+            try:
+                start_extraction(url)
+            except ExtractionBusy as e:
+                log.info("Extraction deferred to the download worker: %s", e)
+        if info and info.get('title') and not title:
+            update_task(task_id, title=info['title'])
+            log.debug("Video title: %s", info['title'])
+        try:
+            check_clip(mode, info)
+        except InvalidMode as e:
+            task_store.delete(task_id)
+            return {"status": "error", "message": str(e)}, 400
         
-        # Apply proxy settings
-        proxy = apply_proxy_settings(ydl_opts)
+        # Apply proxy settings. Media URLs in a cached info dict can be bound
+        # to the address that extracted them, so stick to the same proxy.
+        if info is not None and info_proxy:
+            ydl_opts['proxy'] = info_proxy
+            ydl_opts['socket_timeout'] = config.SOCKET_TIMEOUT
+            proxy = info_proxy
+        elif info is not None:
+            proxy = None
+        else:
+            proxy = apply_proxy_settings(ydl_opts, get_platform(url))
         if proxy:
-            print(f"Using proxy for download: {proxy}")
+            log.info("Using proxy for download: %s", proxy_label(proxy))
         
-        # Get video info if no title was provided
-        if not title:
-            try:
-                info_opts = {'quiet': True}
-                apply_proxy_settings(info_opts)
-                with yt_dlp.YoutubeDL(info_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    if info and 'title' in info:
-                        download_tasks[task_id]['title'] = info['title']
-                        print(f"Video title: {info['title']}")
-            except Exception as e:
-                print(f"Error getting video title: {str(e)}")
+        # Serve identical requests from a finished file or a running download
+        dedup_key = dedup_key_for(url, info, format_id, mode)
+        artifact = artifact_index.lookup(dedup_key)
+        if artifact:
+            log.info("Reusing finished download for %s: %s", dedup_key, artifact['path'])
+            dedup_stats.record('artifact_hits')
+            update_task(
+                task_id,
+                status='finished',
+                progress=100,
+                filename=artifact['path'],
+                title=title or artifact.get('title') or ''
+            )
+            return {
+                "status": "finished",
+                "task_id": task_id
+            }, 200
+        
+        leader_id = inflight_downloads.join(dedup_key, task_id)
+        if leader_id:
+            log.info("Attaching task %s to running download %s", task_id, leader_id)
+            dedup_stats.record('coalesced')
+            update_task(task_id, attached_to=leader_id)
+            return {
+                "status": "queued",
+                "task_id": task_id,
+                "queue_position": download_queue.position(leader_id)
+            }, 200
         
         # Store the output path for later reference
-        download_tasks[task_id]['output_dir'] = storage_dir
-        download_tasks[task_id]['output_template'] = output_path
+        update_task(task_id, output_dir=storage_dir, output_template=output_path, dedup_key=dedup_key)
         
-        # Start download in a new thread
-        import threading
-        thread = threading.Thread(target=download_thread, args=(url, ydl_opts, task_id))
-        thread.daemon = True
-        thread.start()
+        # Hand the download to the worker pool
+        try:
+            download_queue.submit(
+                task_id, run_download, url, ydl_opts, task_id, info, dedup_key, time.monotonic(), mode,
+                priority=priority, group=download_group(url)
+            )
+            dedup_stats.record('fresh_downloads')
+        except QueueFull as e:
+            log.warning("Rejecting download: %s", e)
+            update_task(task_id, status='error', error='The server is busy')
+            finish_download(task_id, dedup_key)
+            task_store.delete(task_id)
+            return {
+                "status": "error",
+                "message": "The server is busy. Please try again in a few minutes."
+            }, 429
         
-        return jsonify({
-            "status": "started",
-            "task_id": task_id
-        })
+        return {
+            "status": "queued",
+            "task_id": task_id,
+            "queue_position": download_queue.position(task_id)
+        }, 200
         
     except Exception as e:
-        download_tasks[task_id] = {"status": "error", "error": str(e)}
-        return jsonify({"status": "error", "message": str(e)})
+        task_store.create(task_id, {"status": "error", "error": str(e)})
+        return {"status": "error", "message": str(e)}, 200
 
 def update_progress(task_id, d):
-    if d['status'] == 'downloading':
+    if task_id in cancelled_tasks:
+        # Raising from the hook is how yt-dlp lets us abort a download
+        raise ytdl.load().utils.DownloadCancelled('Download cancelled')
+    tracker = progress_trackers.get(task_id)
+    if tracker is None:
+        return
+    fields = tracker.on_download(d)
+    if fields:
+        # The cancel request may have reached another worker process
+        if task_cancelled(task_id):
+            raise ytdl.load().utils.DownloadCancelled('Download cancelled')
+        update_task(task_id, **fields)
+
+def update_postprocess(task_id, d):
+    if task_id in cancelled_tasks:
+        raise ytdl.load().utils.DownloadCancelled('Download cancelled')
+    tracker = progress_trackers.get(task_id)
+    if tracker is None:
+        return
+    fields = tracker.on_postprocess(d)
+    if fields:
+        update_task(task_id, **fields)
+
+def task_cancelled(task_id):
+    if task_id in cancelled_tasks:
+        return True
+    task = task_store.get(task_id)
+    if task is not None and task.get('cancel_requested'):
+        cancelled_tasks.add(task_id)
+        return True
+    return False
+
+def fail_task(task_id, error):
+    """Record a failed download, or its cancellation if that is why it failed"""
+    if task_cancelled(task_id):
+        update_task(task_id, status='cancelled', error=None, speed=None, eta=None)
+    else:
+        update_task(task_id, status='error', error=error)
+
+def kill_task_processes(task_id):
+    """Kill child processes (ffmpeg) working on a task's files; Linux only"""
+    killed = 0
+    try:
+        pids = [int(name) for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return killed
+    marker = task_id.encode()
+    for pid in pids:
         try:
-            # Try to get percentage from _percent_str
-            p = d.get('_percent_str', '0%').strip()
-            if p.endswith('%'):
-                try:
-                    download_tasks[task_id]['progress'] = float(p[:-1])
-                except:
-                    # Fallback to calculating percentage
-                    total_bytes = d.get('total_bytes')
-                    downloaded_bytes = d.get('downloaded_bytes')
-                    if total_bytes and downloaded_bytes:
-                        download_tasks[task_id]['progress'] = min(100, downloaded_bytes * 100 / total_bytes)
-                    else:
-                        # If we still can't calculate, use a default
-                        download_tasks[task_id]['progress'] = 0
-        except:
-            # In case of any error, don't crash
-            pass
-    
-    elif d['status'] == 'finished':
-        download_tasks[task_id]['status'] = 'processing'
-        download_tasks[task_id]['progress'] = 100
-        
-        # Store the downloaded filename
-        filename = d.get('filename', '')
-        if filename:
-            download_tasks[task_id]['filename'] = filename
-            print(f"Download finished: {filename}")
-            
-            # Verify the file exists
-            if os.path.exists(filename):
-                file_size = os.path.getsize(filename)
-                print(f"File size: {file_size} bytes")
-                if file_size > 0:
-                    print("File is valid")
-                else:
-                    print("WARNING: File is empty")
-            else:
-                print(f"WARNING: File does not exist: {filename}")
+            with open(f'/proc/{pid}/stat', 'rb') as f:
+                # The parent pid follows the ")" closing the command name
+                ppid = int(f.read().rsplit(b')', 1)[1].split()[1])
+            if ppid != os.getpid():
+                continue
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = f.read()
+        except (OSError, ValueError, IndexError):
+            continue
+        # Every file of a task has the task id in its name
+        if marker in cmdline:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                killed += 1
+            except OSError:
+                pass
+    return killed
+
+def cancel_task(task_id):
+    """Stop a task; return the status it ends up in"""
+    task = task_store.get(task_id)
+    if task is None or task['status'] in FINAL_STATUSES:
+        return task and task['status']
+    
+    if task.get('kind') == 'batch':
+        for item in task.get('items', []):
+            cancel_task(item['task_id'])
+        update_task(task_id, status='cancelled')
+        return 'cancelled'
+    
+    if task.get('attached_to'):
+        # Waiting on another task's download: just stop waiting
+        update_task(task_id, status='cancelled')
+        return 'cancelled'
+    
+    dedup_key = task.get('dedup_key')
+    waiting = [f for f in inflight_downloads.followers(dedup_key)
+               if (task_store.get(f) or {}).get('status') not in FINAL_STATUSES] if dedup_key else []
+    if waiting:
+        # Other requests wait for this download; let it finish for them
+        update_task(task_id, client_cancelled=True)
+        return 'cancelled'
+    
+    if download_queue.cancel(task_id):
+        update_task(task_id, status='cancelled')
+        finish_download(task_id, dedup_key)
+        return 'cancelled'
+    
+    # Running: the progress hooks abort yt-dlp, and an ffmpeg merge or
+    # conversion in progress is killed. A download running in another
+    # worker process picks up cancel_requested from the task store.
+    update_task(task_id, cancel_requested=True)
+    if task_id in progress_trackers:
+        cancelled_tasks.add(task_id)
+    killed = kill_task_processes(task_id)
+    if killed:
+        log.info("Killed %d process(es) of cancelled task %s", killed, task_id)
+    return 'cancelling'
+
+def get_download_name(title, filename):
+    """Build the attachment name shown to the user from a title and a stored file"""
+    # Clean up the title to make it a valid filename
+    safe_title = re.sub(r'[^\w\s-]', '', title or 'video').strip().replace(' ', '_')
+    if not safe_title:
+        safe_title = 'video'
+    
+    # Get the extension from the original file
+    _, ext = os.path.splitext(filename)
+    if not ext:
+        ext = '.mp4'  # Default extension if none is found
+    
+    return f"{safe_title}{ext}"
+
+def send_artifact(path, download_name):
+    """Send a stored file, keeping it safe from eviction while it is served"""
+    storage.touch(path)
+    if config.FILE_SERVE_MODE in ('x-accel-redirect', 'x-sendfile'):
+        bytes_served.inc(os.path.getsize(path), route='offload')
+        return send_file_offload(path, download_name, config.FILE_SERVE_MODE, config.X_ACCEL_REDIRECT_PREFIX)
+    storage.pin(path)
+    response = send_file_range(request.environ, path, download_name, on_close=lambda: storage.unpin(path))
+    if request.method != 'HEAD' and response.status_code in (200, 206):
+        bytes_served.inc(response.content_length or 0, route='file')
+    return response
+
+def count_served(chunks, route):
+    """Pass response chunks through, counting their bytes on /metrics"""
+    for chunk in chunks:
+        bytes_served.inc(len(chunk), route=route)
+        yield chunk
 
 @app.route('/api/download-file/<task_id>')
 def download_file(task_id):
-    if task_id not in download_tasks:
+    task = task_store.get(task_id)
+    if task is None:
         return jsonify({"status": "error", "message": "Download task not found"})
     
-    if download_tasks[task_id]['status'] != 'finished':
+    if task['status'] != 'finished':
         return jsonify({"status": "error", "message": "File not ready yet"})
     
-    filename = download_tasks[task_id].get('filename')
+    filename = storage.output_path(task_id) or task.get('filename')
     if not filename:
-        # Try to find the file by pattern matching if filename is not stored
-        try:
-            output_dir = download_tasks[task_id].get('output_dir')
-            if output_dir and os.path.exists(output_dir):
-                pattern = f"{task_id}.*"
-                matching_files = [f for f in os.listdir(output_dir) if f.startswith(task_id)]
-                if matching_files:
-                    filename = os.path.join(output_dir, matching_files[0])
-                    print(f"Found file by pattern matching: {filename}")
-                    download_tasks[task_id]['filename'] = filename
-        except Exception as e:
-            print(f"Error finding file by pattern: {str(e)}")
+        # Recovery only: the download did not record its output
+        filename = scan_for_output(task_id, task.get('output_dir'))
+        if filename:
+            log.info("Found file by pattern matching: %s", filename)
+            update_task(task_id, filename=filename)
     
     if not filename or not os.path.exists(filename):
-        error_msg = f"File not found for task {task_id}"
-        print(error_msg)
-        download_tasks[task_id]['status'] = 'error'
-        download_tasks[task_id]['error'] = 'File was removed or not properly saved'
+        log.error("File not found for task %s", task_id)
+        update_task(task_id, status='error', error='File was removed or not properly saved')
         return jsonify({
             "status": "error", 
             "message": "File was removed or not properly saved. Please try downloading again."
@@ -380,132 +765,842 @@ def download_file(task_id):
         if file_size == 0:
             return jsonify({"status": "error", "message": "File is empty. The download may have failed."})
         
-        # Get a better filename for the download
-        original_title = download_tasks[task_id].get('title', 'video')
-        # Clean up the title to make it a valid filename
-        safe_title = re.sub(r'[^\w\s-]', '', original_title).strip().replace(' ', '_')
-        if not safe_title:
-            safe_title = 'video'
-        
-        # Get the extension from the original file
-        _, ext = os.path.splitext(filename)
-        if not ext:
-            ext = '.mp4'  # Default extension if none is found
-        
         # Better filename for the user
-        download_name = f"{safe_title}{ext}"
+        download_name = get_download_name(task.get('title'), filename)
         
         # Send the file with a proper attachment name
-        return send_file(
-            filename, 
-            as_attachment=True,
-            download_name=download_name,
-            max_age=0  # Don't cache the file
-        )
+        return send_artifact(filename, download_name)
+    except RequestedRangeNotSatisfiable:
+        raise
     except Exception as e:
-        print(f"Error sending file: {str(e)}")
+        log.error("Error sending file: %s", e)
         return jsonify({"status": "error", "message": f"Error accessing file: {str(e)}"})
 
-def download_thread(url, ydl_opts, task_id):
+def prepare_stream(args):
+    """Check a streaming request and fetch what it needs, without starting ffmpeg.
+    
+    Returns (stream, None) where stream holds the url, title, proxy,
+    de-duplication key and either the finished artifact or the output plan;
+    or (None, error response).
+    """
+    if not config.STREAMING_ENABLED:
+        return None, (jsonify({"status": "error", "message": "Streaming is disabled"}), 404)
+    
+    url = args.get('url', '')
+    format_id = ensure_audio(args.get('format_id', config.DEFAULT_FORMAT))
+    # The muxer streams whole videos only
+    try:
+        if parse_mode(args):
+            raise InvalidMode("Audio-only and clip downloads cannot be streamed. Please use the regular download.")
+    except InvalidMode as e:
+        return None, (jsonify({"status": "error", "message": str(e)}), 400)
+    
+    platform = get_platform(url)
+    if platform == "invalid":
+        return None, (jsonify({"status": "error", "message": "Invalid URL"}), 400)
+    if platform == "unknown":
+        return None, (jsonify({"status": "error", "message": "Unsupported platform"}), 400)
+    
+    # The page has usually extracted the metadata already; otherwise wait
+    # only briefly and let the client come back
+    try:
+        info, proxy = info_cache.get(url)
+        if info is None:
+            result = wait_for_extraction(start_extraction(url), config.EXTRACTION_WAIT)
+            if result is None:
+                return None, (jsonify({
+                    "status": "pending",
+                    "message": "The video is still being checked. Please try again in a moment."
+                }), 503, {'Retry-After': '2'})
+            info, proxy = result
+    except ExtractionBusy as e:
+        log.warning("Rejecting stream: %s", e)
+        return None, (jsonify({
+            "status": "error",
+            "message": "The server is busy. Please try again in a few minutes."
+        }), 429)
+    except Exception as e:
+        log.error("Error extracting info for stream: %s", e)
+        return None, (jsonify({"status": "error", "message": str(e)}), 502)
+    if not info:
+        return None, (jsonify({"status": "error", "message": "Could not extract video information."}), 502)
+    
+    stream = {
+        "url": url,
+        "title": args.get('title', '') or info.get('title', ''),
+        "proxy": proxy,
+        "dedup_key": dedup_key_for(url, info, format_id),
+        "plan": None,
+    }
+    # A finished file for the same video and format needs no ffmpeg at all
+    stream['artifact'] = artifact_index.lookup(stream['dedup_key'])
+    if stream['artifact']:
+        return stream, None
+    
     try:
-        # Ensure ffmpeg is available for merging
-        print(f"Starting download with options: {ydl_opts}")
+        plan = output_plan(url, info, format_id)
+        if plan['path'] == 'transcode':
+            raise StreamingUnavailable(f"{plan['vcodec']}/{plan['acodec']} cannot be copied into MP4")
+        check_streamable(plan['formats'], proxy)
+    except StreamingUnavailable as e:
+        log.warning("Cannot stream %s: %s", url, e)
+        return None, (jsonify({
+            "status": "error",
+            "message": "This video cannot be streamed. Please use the regular download."
+        }), 409)
+    stream['plan'] = plan
+    return stream, None
+
+@app.route('/api/stream/check')
+def check_stream():
+    """Whether /api/stream would stream these parameters right now.
+    
+    Answers like /api/stream does when it cannot, so the page can fall back
+    to the regular download instead of navigating to an error.
+    """
+    stream, error = prepare_stream(request.args)
+    if error is not None:
+        return error
+    if not stream['artifact']:
+        if not stream_slots.acquire(blocking=False):
+            return jsonify({
+                "status": "error",
+                "message": "The server is busy. Please try again in a few minutes."
+            }), 429
+        stream_slots.release()
+    return jsonify({"status": "success"})
+
+@app.route('/api/stream')
+def stream_video():
+    """Opt-in streaming mode: send the muxed video while ffmpeg produces it"""
+    stream, error = prepare_stream(request.args)
+    if error is not None:
+        return error
+    url, title, dedup_key = stream['url'], stream['title'], stream['dedup_key']
+    
+    artifact = stream['artifact']
+    if artifact:
+        dedup_stats.record('artifact_hits')
+        return send_artifact(artifact['path'], get_download_name(title, artifact['path']))
+    
+    if not stream_slots.acquire(blocking=False):
+        return jsonify({
+            "status": "error",
+            "message": "The server is busy. Please try again in a few minutes."
+        }), 429
+    
+    task_id = str(uuid.uuid4())
+    part_path = os.path.join(DOWNLOADS_DIR, f"{task_id}.stream.part")
+    final_path = os.path.join(DOWNLOADS_DIR, f"{task_id}.mp4")
+    plan = stream['plan']
+    try:
+        mux = MuxStream(plan['formats'], part_path, stream['proxy'], config.SOCKET_TIMEOUT)
+        storage.pin(task_id)
+        storage.enforce(plan['filesize'], task_id)
+        mux.start()
+    except (StreamingUnavailable, OSError) as e:
+        storage.unpin(task_id)
+        stream_slots.release()
+        log.warning("Cannot stream %s: %s", url, e)
+        return jsonify({
+            "status": "error",
+            "message": "This video cannot be streamed. Please use the regular download."
+        }), 409
+    
+    task_store.create(task_id, {"status": "streaming", "progress": 0, "title": title})
+    dedup_stats.record('fresh_downloads')
+    
+    cleaned_up = []
+    
+    def cleanup():
+        # Runs when the stream ends or the response is closed, including
+        # when the client disconnects before the first chunk
+        if cleaned_up:
+            return
+        cleaned_up.append(True)
+        mux.close()
+        if os.path.exists(part_path):
+            # Don't keep a truncated file
+            remove_file(part_path)
+            if task_store.get(task_id)['status'] == 'streaming':
+                update_task(task_id, status='error', error='Stream was interrupted')
+        storage.unpin(task_id)
+        stream_slots.release()
+    
+    def generate():
+        try:
+            yield from count_served(mux.iter_chunks(), 'stream')
+        except Exception as e:
+            # Headers are already sent, so the client just sees a short file
+            log.error("Error while streaming %s: %s", url, e)
+            update_task(task_id, status='error', error=str(e))
+        else:
+            os.replace(part_path, final_path)
+            storage.record_output(task_id, final_path)
+            update_task(task_id, status='finished', progress=100, filename=final_path)
+            artifact_index.record(dedup_key, final_path, title)
+        finally:
+            cleanup()
+    
+    response = Response(generate(), mimetype='video/mp4', headers={
+        'Content-Disposition': attachment_header(get_download_name(title, final_path)),
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        'X-Task-Id': task_id,
+    })
+    response.call_on_close(cleanup)
+    return response
+
+def scan_for_output(task_id, output_dir):
+    """Find a task's file by listing the output directory (slow fallback)"""
+    try:
+        if output_dir and os.path.exists(output_dir):
+            for name in os.listdir(output_dir):
+                if name.startswith(f"{task_id}.") and not name.endswith('.part'):
+                    return os.path.join(output_dir, name)
+    except OSError as e:
+        log.error("Error finding file by pattern: %s", e)
+    return None
+
+def resolve_output(task_id, result):
+    """Return the final file a finished yt-dlp run produced for task_id.
+
+    yt-dlp reports the path after post-processing in requested_downloads;
+    the post-processor hook has stored the same path on the task.
+    """
+    for download in reversed((result or {}).get('requested_downloads') or ()):
+        filepath = download.get('filepath')
+        if filepath and os.path.exists(filepath):
+            return filepath
+    task = task_store.get(task_id)
+    filename = task.get('filename')
+    if filename and os.path.exists(filename):
+        return filename
+    return scan_for_output(task_id, task.get('output_dir'))
+
+def complete_download(task_id, result, label='Download successful'):
+    """Record the output of a finished yt-dlp run; raise if there is none"""
+    filename = resolve_output(task_id, result)
+    if not filename or os.path.getsize(filename) == 0:
+        raise OutputMissing("Download completed but file was not found or empty")
+    storage.record_output(task_id, filename)
+    update_task(task_id, filename=filename, status='finished')
+    log.info("%s: %s", label, filename)
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def run_download(url, ydl_opts, task_id, info, dedup_key, submitted, mode=None):
+    """Worker entry point: download, then share the result with attached tasks"""
+    platform = get_platform(url)
+    queue_wait_seconds.observe(time.monotonic() - submitted, platform=platform)
+    progress_trackers[task_id] = ProgressTracker(config.PROGRESS_WRITE_INTERVAL)
+    storage.pin(task_id)
+    try:
+        download_thread(url, ydl_opts, task_id, info, mode)
+    finally:
+        tracker = progress_trackers.pop(task_id, None)
+        record_download_metrics(task_id, platform, ydl_opts.get('proxy'), tracker, submitted)
+        finish_download(task_id, dedup_key)
+        storage.unpin(task_id)
+        cancelled_tasks.discard(task_id)
+        if (task_store.get(task_id) or {}).get('status') in ('cancelled', 'error'):
+            # Drop the partial streams of the aborted or failed download;
+            # task ids are never reused, so nothing could resume them
+            storage.discard(task_id)
+        storage.enforce()
+
+def record_download_metrics(task_id, platform, proxy, tracker, submitted):
+    task = task_store.get(task_id) or {}
+    proxy = proxy_label(proxy)
+    task_seconds.observe(time.monotonic() - submitted, platform=platform, proxy=proxy,
+                         status=task.get('status', 'unknown'))
+    if tracker is None or task.get('status') != 'finished':
+        return
+    transfer = tracker.transfer_rate()
+    if transfer is not None:
+        transfer_throughput.observe(transfer[1], platform=platform, proxy=proxy)
+    if tracker.merge_seconds:
+        merge_seconds.observe(tracker.merge_seconds, platform=platform, proxy=proxy)
+
+def finish_download(task_id, dedup_key):
+    task = task_store.get(task_id)
+    if task['status'] == 'finished' and task.get('filename'):
+        artifact_index.record(dedup_key, task['filename'], task.get('title'))
+    
+    for follower_id in inflight_downloads.finish(dedup_key):
+        shared = {key: task[key] for key in ('status', 'progress', 'filename', 'error') if key in task}
+        follower = task_store.get(follower_id)
+        if follower is None or follower['status'] == 'cancelled':
+            continue
+        if not follower.get('title') and task.get('title'):
+            shared['title'] = task['title']
+        update_task(follower_id, **shared)
+
+def download_thread(url, ydl_opts, task_id, info=None, mode=None):
+    if task_cancelled(task_id):
+        # Cancelled through another worker process while it was queued here
+        fail_task(task_id, None)
+        return
+    update_task(task_id, status='started')
+    try:
+        if info is None:
+            # Extract once; the download below reuses the same info dict
+            try:
+                info, proxy = extract_with_deadline(url)
+            except ExtractionBusy:
+                info, proxy = extract_video_info(url)
+            if proxy:
+                ydl_opts['proxy'] = proxy
+                ydl_opts['socket_timeout'] = config.SOCKET_TIMEOUT
+            else:
+                ydl_opts.pop('proxy', None)
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # First try with the requested format
+        # Known only now when the download was queued before the metadata
+        check_clip(mode, info)
+        plan_download(url, info, ydl_opts, task_id, mode)
+        
+        budget = RetryBudget(config.DOWNLOAD_RETRIES, config.DOWNLOAD_RETRY_BASE, config.DOWNLOAD_RETRY_MAX)
+        failure = None
+        while True:
             try:
-                # Extract info first to check if we need special handling
-                info = ydl.extract_info(url, download=False)
-                if info:
-                    # Store the title if available
-                    if 'title' in info and info['title']:
-                        download_tasks[task_id]['title'] = info['title']
+                if failure is not None:
+                    info = prepare_retry(failure, url, ydl_opts, task_id, info, mode)
+                    # The progress hooks do not touch the status
+                    update_task(task_id, status='started')
+                log.debug("Starting download %s with options: %s", task_id, ydl_opts)
+                # Built per task: the options carry its hooks and output path
+                with ytdl.load().YoutubeDL(ydl_opts) as ydl:
+                    # Download straight from the metadata instead of running
+                    # the extractor again
+                    result = ydl.process_ie_result(info, download=True)
+                if ydl_opts.get('proxy'):
+                    proxy_pool.report_success(ydl_opts['proxy'])
                 
-                # Now do the actual download
-                ydl.download([url])
+                # Store the title if available
+                if info and info.get('title'):
+                    update_task(task_id, title=info['title'])
                 
-                # Verify the file exists after download
-                output_dir = download_tasks[task_id].get('output_dir')
-                if output_dir and os.path.exists(output_dir):
-                    pattern = f"{task_id}.*"
-                    matching_files = [f for f in os.listdir(output_dir) if f.startswith(task_id)]
-                    if matching_files:
-                        filename = os.path.join(output_dir, matching_files[0])
-                        download_tasks[task_id]['filename'] = filename
-                        print(f"Download successful: {filename}")
-                        if os.path.exists(filename) and os.path.getsize(filename) > 0:
-                            download_tasks[task_id]['status'] = 'finished'
-                            return
-                
-                # If we didn't find the file or it was empty, try again with a different format
-                if download_tasks[task_id]['status'] != 'finished':
-                    raise Exception("Download completed but file was not found or empty")
-                    
-            except Exception as format_error:
-                # If the specific format fails, try with best format
-                try:
-                    # Log the original error
-                    print(f"Error with format {ydl_opts['format']}: {str(format_error)}")
-                    download_tasks[task_id]['status'] = 'retrying'
-                    download_tasks[task_id]['progress'] = 0
-                    
-                    # Try with a simpler format option that ensures both audio and video
-                    ydl_opts['format'] = 'bestvideo+bestaudio/best'
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl2:
-                        ydl2.download([url])
-                    
-                    # Verify the file exists after download
-                    output_dir = download_tasks[task_id].get('output_dir')
-                    if output_dir and os.path.exists(output_dir):
-                        pattern = f"{task_id}.*"
-                        matching_files = [f for f in os.listdir(output_dir) if f.startswith(task_id)]
-                        if matching_files:
-                            filename = os.path.join(output_dir, matching_files[0])
-                            download_tasks[task_id]['filename'] = filename
-                            print(f"Download successful (retry): {filename}")
-                            if os.path.exists(filename) and os.path.getsize(filename) > 0:
-                                download_tasks[task_id]['status'] = 'finished'
-                                return
-                    
-                    # If we still didn't find the file, raise an error
-                    raise Exception("Retry download completed but file was not found or empty")
-                    
-                except Exception as e:
-                    # If that also fails, report the error
-                    download_tasks[task_id]['status'] = 'error'
-                    download_tasks[task_id]['error'] = f"Format error: {str(e)}"
+                complete_download(task_id, result, 'Download successful' if failure is None else
+                                  f'Download successful after {budget.used} retries')
+                return
+            except Exception as e:
+                if task_cancelled(task_id):
+                    fail_task(task_id, None)
+                    return
+                failure = classify(e)
+                if failure == FORMAT and ydl_opts['format'] == fallback_format(mode):
+                    # Nothing left to fall back to
+                    failure = FATAL
+                elif failure == POSTPROCESS and all(
+                        ydl_opts.get(key) == value
+                        for key, value in postprocess_retry_options(task_id, mode).items()):
+                    # The same post-processing would fail the same way
+                    failure = FATAL
+                delay = budget.next_delay() if failure != FATAL else None
+                if delay is None:
+                    raise
+                download_retries.inc(reason=failure)
+                log.warning("Download %s failed (%s); retry %d of %d in %.1fs: %s",
+                            task_id, failure, budget.used, budget.retries, delay, e)
+                update_task(task_id, status='retrying', retry_reason=failure, retries=budget.used,
+                            speed=None, eta=None)
+                if not sleep_unless_cancelled(task_id, delay):
+                    fail_task(task_id, None)
+                    return
     except Exception as e:
-        download_tasks[task_id]['status'] = 'error'
-        download_tasks[task_id]['error'] = str(e)
+        fail_task(task_id, str(e))
 
-@app.route('/api/status/<task_id>')
-def get_status(task_id):
-    if task_id not in download_tasks:
-        return jsonify({"status": "not_found"})
+def plan_download(url, info, ydl_opts, task_id, mode=None):
+    """Decide up front whether ffmpeg can stream-copy or has to transcode"""
+    try:
+        plan = output_plan(url, info, ydl_opts['format'], mode)
+        if is_audio(mode):
+            apply_audio_plan(ydl_opts, plan, mode['audio_format'])
+        else:
+            apply_plan(ydl_opts, plan)
+        tracker = progress_trackers.get(task_id)
+        if tracker is not None:
+            tracker.expect(plan['formats'])
+        update_task(task_id, ffmpeg_path=plan['path'], vcodec=plan['vcodec'], acodec=plan['acodec'])
+        log.debug("Output plan for %s: %s (%s/%s)", plan['format_id'], plan['path'], plan['vcodec'], plan['acodec'])
+        # Make room for the streams before writing them
+        storage.enforce(expected_size(mode, info, plan['filesize']), task_id)
+    except Exception as e:
+        # Keep the default convert-to-mp4 post-processing
+        log.warning("Error planning output format: %s", e)
+
+def prepare_retry(failure, url, ydl_opts, task_id, info, mode=None):
+    """Adjust a failed download for its next attempt; return the info dict to use.
+    
+    Files already on disk are kept: yt-dlp resumes .part files and skips
+    streams that were downloaded completely.
+    """
+    if failure in (NETWORK, EXPIRED):
+        failed_proxy = ydl_opts.get('proxy')
+        if failed_proxy and failure == NETWORK:
+            proxy_pool.report_failure(failed_proxy)
+        if failed_proxy or failure == EXPIRED:
+            # Media URLs can be bound to the address that extracted them, so
+            # extract again, through another proxy when this one failed
+            info_cache.invalidate(url)
+            info, proxy = extract_video_info(url)
+            if proxy:
+                ydl_opts['proxy'] = proxy
+                ydl_opts['socket_timeout'] = config.SOCKET_TIMEOUT
+            else:
+                ydl_opts.pop('proxy', None)
+            log.info("Resuming download %s through proxy: %s", task_id, proxy_label(proxy))
+    elif failure == FORMAT:
+        # A different format means different streams: start them from zero
+        ydl_opts['format'] = fallback_format(mode)
+        progress_trackers[task_id] = ProgressTracker(config.PROGRESS_WRITE_INTERVAL)
+        plan_download(url, info, ydl_opts, task_id, mode)
+        update_task(task_id, progress=0)
+    elif failure == POSTPROCESS:
+        ydl_opts.update(postprocess_retry_options(task_id, mode))
+        if not is_audio(mode):
+            update_task(task_id, ffmpeg_path='transcode')
+    # OUTPUT: run again as it is; yt-dlp finds the finished file and reports it
+    return info
+
+def postprocess_retry_options(task_id, mode=None):
+    """The yt-dlp options that redo a failed post-processing step"""
+    if is_audio(mode):
+        # A single stream: extract the audio from it again
+        return {'postprocessors': audio_postprocessors(mode['audio_format'])}
+    # Redo only the post-processing, the safest way: convert with ffmpeg,
+    # and merge into mkv (which takes any codec) if the separate streams
+    # are still there, i.e. the merge itself failed
+    options = {'postprocessors': [{'key': 'FFmpegVideoConvertor', 'preferedformat': config.MERGE_OUTPUT_FORMAT}]}
+    if any(name.startswith(f"{task_id}.f") and not name.endswith(PARTIAL_SUFFIXES)
+           for name in os.listdir(DOWNLOADS_DIR)):
+        options['merge_output_format'] = 'mkv'
+    return options
+
+def sleep_unless_cancelled(task_id, seconds):
+    """Wait before a retry; return False as soon as the task is cancelled"""
+    deadline = time.monotonic() + seconds
+    while True:
+        if task_cancelled(task_id):
+            return False
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return True
+        time.sleep(min(0.5, remaining))
+
+def task_status(task_id):
+    """Return the client-facing view of a task, or None if it does not exist"""
+    task = task_store.get(task_id)
+    if task is None:
+        return None
     
     response_data = {}
-    # Create a copy of task data, not the actual reference
-    for key, value in download_tasks[task_id].items():
+    # The store returns a copy of the task data, not the actual reference
+    for key, value in task.items():
         # Include all fields except potentially sensitive ones
-        if key not in ['output_dir', 'output_template']:
+        if key not in ['output_dir', 'output_template', 'attached_to', 'dedup_key',
+                       'cancel_requested', 'client_cancelled']:
             response_data[key] = value
     
+    if task.get('client_cancelled'):
+        # The download goes on for other requests, not for this one
+        response_data['status'] = 'cancelled'
+        return response_data
+    
+    # Tasks attached to another download report that download's progress
+    source_id = task.get('attached_to', task_id)
+    source = task_store.get(source_id) if source_id != task_id else None
+    if source is not None and response_data['status'] == 'queued':
+        response_data['status'] = source['status']
+        response_data['progress'] = source.get('progress', 0)
+    
+    if response_data.get('status') == 'queued':
+        response_data['queue_position'] = download_queue.position(source_id)
+    
+    return response_data
+
+@app.route('/api/status/<task_id>')
+def get_status(task_id):
+    response_data = task_status(task_id)
+    if response_data is None:
+        return jsonify({"status": "not_found"})
     return jsonify(response_data)
 
+@app.route('/api/task/<task_id>', methods=['DELETE'])
+def delete_task(task_id):
+    """Stop a download: dequeue it, or abort yt-dlp and ffmpeg and drop its partial files"""
+    task = task_store.get(task_id)
+    if task is None:
+        return jsonify({"status": "not_found"}), 404
+    if task['status'] == 'streaming':
+        return jsonify({
+            "status": "error",
+            "message": "A stream stops when the client disconnects"
+        }), 409
+    return jsonify({"status": cancel_task(task_id), "task_id": task_id})
+
+def size_progress_streams(worker_class, connections, threads):
+    """Set the progress stream cap for this worker process, unless config sets one"""
+    global sse_capacity, sse_slots
+    if config.SSE_MAX_CONNECTIONS:
+        return
+    # Greenlet workers hold a connection per greenlet, the others a thread
+    greenlets = worker_class.split('.')[-1].lower().startswith(('gevent', 'eventlet'))
+    sse_capacity = max(1, int((connections if greenlets else threads) * config.SSE_CONNECTION_SHARE))
+    sse_slots = threading.BoundedSemaphore(sse_capacity)
+    log.info("Allowing %d progress streams per worker", sse_capacity)
+
+@app.route('/api/progress/<task_id>')
+def progress_stream(task_id):
+    """Server-Sent Events stream of a task's status, pushed as it changes"""
+    task = task_store.get(task_id)
+    if task is None:
+        return jsonify({"status": "not_found"}), 404
+    
+    # Attached tasks change when the download they are attached to does
+    watched = [task_id]
+    if task.get('attached_to'):
+        watched.append(task['attached_to'])
+    
+    slots = sse_slots
+    if not slots.acquire(blocking=False):
+        # The page falls back to polling /api/status
+        return jsonify({"status": "error", "message": "Too many progress streams"}), 503, {'Retry-After': '30'}
+    released = []
+    
+    def release():
+        # Runs when the stream ends or the response is closed, including
+        # when the client disconnects before the first event
+        if not released:
+            released.append(True)
+            slots.release()
+    
+    def stream():
+        notifications = progress_broker.subscribe(watched)
+        try:
+            last_sent = None
+            last_write = time.monotonic()
+            deadline = last_write + config.SSE_MAX_DURATION
+            while True:
+                data = task_status(task_id)
+                if data is None:
+                    data = {"status": "not_found"}
+                
+                # Only push real changes
+                snapshot = json.dumps(data, sort_keys=True)
+                if snapshot != last_sent:
+                    last_sent = snapshot
+                    last_write = time.monotonic()
+                    yield f"data: {snapshot}\n\n"
+                
+                if data['status'] in FINAL_STATUSES + ('not_found',):
+                    yield "event: done\ndata: {}\n\n"
+                    return
+                
+                now = time.monotonic()
+                if now >= deadline:
+                    # Let the browser reconnect rather than holding a
+                    # connection forever
+                    return
+                if now - last_write >= config.SSE_HEARTBEAT_INTERVAL:
+                    last_write = now
+                    yield ": heartbeat\n\n"
+                
+                # Wait for a local notification. The timeout also covers
+                # downloads running in another worker process, which can
+                # only be seen by re-reading the task store.
+                try:
+                    notifications.get(timeout=config.SSE_POLL_INTERVAL)
+                    while True:
+                        notifications.get_nowait()
+                except queue.Empty:
+                    pass
+        finally:
+            progress_broker.unsubscribe(watched, notifications)
+            release()
+    
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Don't let a front proxy buffer events
+    })
+    response.call_on_close(release)
+    return response
+
+def expand_playlist(url):
+    """Return (url, title) for every entry of a playlist, or for the video itself"""
+    ydl_opts = {
+        'quiet': True,
+        'extract_flat': 'in_playlist',  # List the entries without extracting each one
+        'playlistend': config.BATCH_MAX_ITEMS,
+    }
+    apply_proxy_settings(ydl_opts, get_platform(url))
+    with ytdl.pool.borrow(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if not info:
+        return []
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return [(info.get('webpage_url') or url, info.get('title', ''))]
+    
+    items = []
+    for entry in info.get('entries') or ():
+        if not entry:
+            continue
+        entry_url = entry.get('webpage_url') or entry.get('url')
+        if entry_url and is_valid_url(entry_url):
+            items.append((entry_url, entry.get('title') or ''))
+    return items
+
+def schedule_batch(batch_id, items, format_id, priority, mode=None):
+    """Create a download task for every (url, title) of a batch"""
+    scheduled, errors = [], []
+    for url, title in items[:config.BATCH_MAX_ITEMS]:
+        payload, _ = create_download(url, format_id, title, priority, mode)
+        if payload.get('task_id'):
+            scheduled.append({"task_id": payload['task_id'], "url": url})
+        else:
+            errors.append({"url": url, "message": payload.get('message')})
+    update_task(batch_id, status='running', items=scheduled, errors=errors)
+
+def expand_batch(batch_id, url, format_id, priority, mode=None):
+    """Extraction pool job: turn a playlist URL into the batch's downloads"""
+    try:
+        items = expand_playlist(url)
+    except Exception as e:
+        log.error("Error expanding playlist %s: %s", url, e)
+        update_task(batch_id, status='error', error=str(e))
+        return
+    if not items:
+        update_task(batch_id, status='error', error='No videos found at this URL')
+        return
+    schedule_batch(batch_id, items, format_id, priority, mode)
+
+def fail_unfinished_batch(batch_id, future):
+    # The job never ran (deadline passed in the queue, or cancelled)
+    if future.cancelled() or future.exception() is not None:
+        update_task(batch_id, status='error', error='Could not list the playlist in time')
+
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    """Download a list of URLs, or every video of a playlist, as one batch"""
+    urls = request.json.get('urls') or []
+    playlist_url = request.json.get('url', '')
+    try:
+        priority = int(request.json.get('priority', 0))
+    except (TypeError, ValueError):
+        priority = 0
+    try:
+        mode = parse_mode(request.json)
+    except InvalidMode as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    format_id = download_format(request.json.get('format_id', config.DEFAULT_FORMAT), mode)
+    
+    if not isinstance(urls, list) or not isinstance(playlist_url, str) or not (urls or playlist_url):
+        return jsonify({"status": "error", "message": "A list of URLs or a playlist URL is required"}), 400
+    if not all(isinstance(u, str) for u in urls):
+        return jsonify({"status": "error", "message": "Every URL must be a string"}), 400
+    if len(urls) > config.BATCH_MAX_ITEMS:
+        return jsonify({
+            "status": "error",
+            "message": f"A batch can hold at most {config.BATCH_MAX_ITEMS} videos"
+        }), 400
+    invalid = [u for u in urls or [playlist_url] if get_platform(u) in ("invalid", "unknown")]
+    if invalid:
+        return jsonify({"status": "error", "message": "Invalid or unsupported URLs", "urls": invalid}), 400
+    if urls and download_queue.free_slots() < len(urls):
+        return jsonify({
+            "status": "error",
+            "message": "The server is busy. Please try again in a few minutes."
+        }), 429
+    
+    batch_id = str(uuid.uuid4())
+    task_store.create(batch_id, {
+        "kind": "batch",
+        "status": "running" if urls else "expanding",
+        "items": [],
+        "errors": [],
+    })
+    
+    if urls:
+        schedule_batch(batch_id, [(u, '') for u in urls], format_id, priority, mode)
+    else:
+        # Listing a playlist is an extraction; keep it off the request thread
+        try:
+            job = extraction_pool.submit(
+                f"batch:{batch_id}", expand_batch, batch_id, playlist_url, format_id, priority, mode
+            )
+        except ExtractionBusy as e:
+            log.warning("Rejecting batch: %s", e)
+            task_store.delete(batch_id)
+            return jsonify({
+                "status": "error",
+                "message": "The server is busy. Please try again in a few minutes."
+            }), 429
+        job.future.add_done_callback(lambda future: fail_unfinished_batch(batch_id, future))
+    
+    return jsonify({"status": "queued", "batch_id": batch_id})
+
+def batch_status(batch_id):
+    """Return per-item and aggregate progress of a batch, or None if it does not exist"""
+    batch = task_store.get(batch_id)
+    if batch is None or batch.get('kind') != 'batch':
+        return None
+    
+    items, counts = [], {}
+    progress_sum = 0
+    for item in batch.get('items', []):
+        data = task_status(item['task_id']) or {"status": "not_found"}
+        status = data['status']
+        counts[status] = counts.get(status, 0) + 1
+        done = status in FINAL_STATUSES + ('not_found',)
+        progress_sum += 100 if done else data.get('progress') or 0
+        items.append({
+            "task_id": item['task_id'],
+            "url": item['url'],
+            "title": data.get('title', ''),
+            "status": status,
+            "progress": 100 if status == 'finished' else data.get('progress') or 0,
+            "error": data.get('error'),
+        })
+    
+    if batch['status'] in ('expanding', 'error', 'cancelled'):
+        status = batch['status']
+    elif all(item['status'] in FINAL_STATUSES + ('not_found',) for item in items):
+        status = 'finished' if counts.get('finished') else 'error'
+    else:
+        status = 'running'
+    
+    return {
+        "status": status,
+        "batch_id": batch_id,
+        "progress": round(progress_sum / len(items), 1) if items else 0,
+        "counts": counts,
+        "items": items,
+        "errors": batch.get('errors', []),
+        "error": batch.get('error'),
+    }
+
+@app.route('/api/batch/<batch_id>')
+def get_batch(batch_id):
+    data = batch_status(batch_id)
+    if data is None:
+        return jsonify({"status": "not_found"}), 404
+    return jsonify(data)
+
+@app.route('/api/batch/<batch_id>/zip')
+def download_batch_zip(batch_id):
+    """Stream the finished videos of a batch as one ZIP archive"""
+    data = batch_status(batch_id)
+    if data is None:
+        return jsonify({"status": "not_found"}), 404
+    if data['status'] in ('expanding', 'running'):
+        return jsonify({"status": "error", "message": "The batch is still downloading"}), 409
+    
+    entries, names = [], set()
+    for item in data['items']:
+        if item['status'] != 'finished':
+            continue
+        task = task_store.get(item['task_id']) or {}
+        filename = storage.output_path(item['task_id']) or task.get('filename')
+        if not filename or not os.path.exists(filename):
+            continue
+        name = get_download_name(item['title'], filename)
+        base, ext = os.path.splitext(name)
+        counter = 2
+        while name in names:
+            name = f"{base}_{counter}{ext}"
+            counter += 1
+        names.add(name)
+        entries.append((filename, name))
+    if not entries:
+        return jsonify({"status": "error", "message": "No finished videos in this batch"}), 404
+    
+    for path, _ in entries:
+        storage.pin(path)
+    released = []
+    
+    def release():
+        if released:
+            return
+        released.append(True)
+        for path, _ in entries:
+            storage.unpin(path)
+    
+    def generate():
+        try:
+            yield from count_served(iter_zip(entries), 'zip')
+        finally:
+            release()
+    
+    response = Response(generate(), mimetype='application/zip', headers={
+        'Content-Disposition': attachment_header(f"videos-{batch_id[:8]}.zip"),
+        'X-Accel-Buffering': 'no',
+    })
+    response.call_on_close(release)
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus text exposition of this process's metrics"""
+    queue = download_queue.stats()
+    queue_depth.set(queue['queued'])
+    active_workers.set(queue['active'], pool='download')
+    worker_slots.set(queue['workers'], pool='download')
+    extraction = extraction_pool.stats()
+    active_workers.set(min(extraction['pending'], extraction['workers']), pool='extraction')
+    worker_slots.set(extraction['workers'], pool='extraction')
+    
+    cache = info_cache.stats()
+    cache_lookups.set(cache['hits'], cache='info', result='hit')
+    cache_lookups.set(cache['misses'], cache='info', result='miss')
+    cache_lookups.set(cache['plan_hits'], cache='plan', result='hit')
+    cache_lookups.set(cache['plan_misses'], cache='plan', result='miss')
+    dedup = dedup_stats.snapshot()
+    for outcome in ('artifact_hits', 'coalesced', 'fresh_downloads'):
+        dedup_outcomes.set(dedup[outcome], outcome=outcome)
+    
+    disk = storage.stats()
+    storage_bytes.set(disk['bytes_used'])
+    for reason, key in (('eviction', 'evictions'), ('expiration', 'expirations'), ('partial', 'reclaimed_partials')):
+        storage_removals.set(disk[key], reason=reason)
+    for proxy, stats in proxy_pool.stats().items():
+        proxy_score.set(stats['score'], proxy=proxy)
+        proxy_quarantined.set(1 if stats['quarantined_for'] else 0, proxy=proxy)
+    return Response(metrics.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/stats')
+def get_stats():
+    return jsonify({
+        "info_cache": info_cache.stats(),
+        "extraction": extraction_pool.stats(),
+        "download_queue": download_queue.stats(),
+        "proxies": proxy_pool.stats(),
+        "youtube_dl_pool": ytdl.pool.stats(),
+        "storage": storage.stats(),
+        "progress_streams": {"max": sse_capacity, "subscribers": progress_broker.subscriber_count()},
+        "dedup": dict(dedup_stats.snapshot(), in_flight=len(inflight_downloads), artifacts=len(artifact_index))
+    })
+
 # Create downloads directory at startup
-if not os.path.exists('downloads'):
-    os.makedirs('downloads', exist_ok=True)
-    print("Created downloads directory")
+if not os.path.exists(DOWNLOADS_DIR):
+    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    log.info("Created downloads directory")
+
+# Index the directory, cleaning up after tasks that died with the previous
+# server process
+storage.rescan()
+storage.enforce()
 
 if __name__ == '__main__':
     # Check if FFmpeg is available
-    try:
-        import subprocess
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=False)
-        print("FFmpeg is available - audio and video merging will work correctly.")
-    except (subprocess.SubprocessError, FileNotFoundError):
-        print("WARNING: FFmpeg is not available in PATH. Audio and video merging may not work correctly.")
-        print("Please install FFmpeg to ensure videos have both audio and video streams.")
+    if ytdl.ffmpeg_info()['available']:
+        log.info("FFmpeg is available - audio and video merging will work correctly.")
+    else:
+        log.warning("FFmpeg is not available in PATH. Audio and video merging may not work correctly.")
+        log.warning("Please install FFmpeg to ensure videos have both audio and video streams.")
     
     # Configuration for production
     # When running directly, use 0.0.0.0 to listen on all interfaces
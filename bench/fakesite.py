@@ -0,0 +1,277 @@
+# Local stand-in for a video site
+#
+# Benchmarks must not depend on YouTube and friends: results would measure
+# their servers, and CI has no network. FakeSite serves synthetic video and
+# audio streams (generated once with ffmpeg) over HTTP with Range support, a
+# per-connection bandwidth cap and a first-byte latency. register_extractor()
+# teaches yt-dlp to extract its watch pages, and SocksProxy is a minimal
+# SOCKS5 relay to put in PROXY_LIST so the proxy code paths run too.
+
+import json
+import os
+import re
+import select
+import socket
+import struct
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingTCPServer, StreamRequestHandler
+
+CHUNK_SIZE = 64 * 1024
+DURATION = 10  # Seconds of media; sizes are reached through the bitrate
+GOP = 50  # Frames between keyframes (2s at 25 fps), so clips can seek like on real sites
+
+
+def ensure_media(directory, video_bytes, audio_bytes):
+    """Generate the synthetic streams for the given sizes unless cached.
+
+    Returns a list of format dicts (without URLs) describing the files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    # Noise keeps x264 from compressing below the requested bitrate
+    video_rate = max(64000, video_bytes * 8 // DURATION)
+    audio_rate = min(320000, max(32000, audio_bytes * 8 // DURATION))
+    specs = [
+        {'format_id': '136', 'file': f'v720-{video_rate}-g{GOP}.mp4', 'ext': 'mp4', 'vcodec': 'avc1.64001f',
+         'acodec': 'none', 'height': 720, 'width': 1280, 'fps': 25, 'bitrate': video_rate,
+         'input': 'testsrc2=size=1280x720:rate=25,noise=alls=60:allf=t'},
+        {'format_id': '134', 'file': f'v360-{video_rate // 2}-g{GOP}.mp4', 'ext': 'mp4', 'vcodec': 'avc1.64001e',
+         'acodec': 'none', 'height': 360, 'width': 640, 'fps': 25, 'bitrate': video_rate // 2,
+         'input': 'testsrc2=size=640x360:rate=25,noise=alls=60:allf=t'},
+        {'format_id': '140', 'file': f'audio-{audio_rate}.m4a', 'ext': 'm4a', 'vcodec': 'none',
+         'acodec': 'mp4a.40.2', 'abr': audio_rate // 1000, 'bitrate': audio_rate,
+         'input': f'sine=frequency=440:duration={DURATION}'},
+    ]
+    formats = []
+    for spec in specs:
+        path = os.path.join(directory, spec.pop('file'))
+        source, bitrate = spec.pop('input'), spec.pop('bitrate')
+        if not os.path.exists(path):
+            _encode(path, source, bitrate, audio=spec['vcodec'] == 'none')
+        spec['path'] = os.path.basename(path)
+        spec['filesize'] = os.path.getsize(path)
+        formats.append(spec)
+    return formats
+
+
+def _encode(path, source, bitrate, audio):
+    if audio:
+        codec = ['-c:a', 'aac', '-b:a', str(bitrate)]
+    else:
+        codec = ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-g', str(GOP), '-b:v', str(bitrate),
+                 '-maxrate', str(bitrate), '-bufsize', str(bitrate // 2), '-an']
+    tmp = path + '.tmp' + os.path.splitext(path)[1]
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', source,
+                    '-t', str(DURATION)] + codec + ['-movflags', '+faststart', tmp], check=True)
+    os.replace(tmp, path)
+
+
+class _SiteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        site = self.server.site
+        if site.latency:
+            time.sleep(site.latency)
+        path = self.path.split('?', 1)[0]
+        if path == '/health':
+            return self._send_bytes(b'ok', 'text/plain')
+        match = re.match(r'/watch/([\w-]+)$', path)
+        if match:
+            site.pages_served += 1
+            page = {'id': match.group(1), 'title': f'Bench video {match.group(1)}', 'duration': DURATION,
+                    'formats': site.formats}
+            return self._send_bytes(json.dumps(page).encode(), 'application/json')
+        return self._send_media(path.lstrip('/'))
+
+    def _send_bytes(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_media(self, name):
+        site = self.server.site
+        if name not in site.files:
+            self.send_error(404)
+            return
+        path = os.path.join(site.media_dir, name)
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4' if name.endswith('.mp4') else 'audio/mp4')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        left = end - start + 1
+        started = time.monotonic()
+        sent = 0
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while left > 0:
+                chunk = f.read(min(CHUNK_SIZE, left))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except OSError:
+                    return
+                left -= len(chunk)
+                sent += len(chunk)
+                if site.bandwidth:
+                    # Pace the connection to the configured rate
+                    delay = sent / site.bandwidth - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+        site.bytes_sent += sent
+
+
+class FakeSite:
+    """HTTP server for watch pages (JSON metadata) and media files.
+
+    bandwidth is bytes per second per connection (0 = unlimited); latency is
+    added before every response.
+    """
+
+    def __init__(self, media_dir, video_bytes=5 * 1024 ** 2, audio_bytes=160 * 1024,
+                 bandwidth=0, latency=0.0, host='127.0.0.1'):
+        self.media_dir = media_dir
+        self.formats = ensure_media(media_dir, video_bytes, audio_bytes)
+        self.files = {f['path'] for f in self.formats}
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.pages_served = 0
+        self.bytes_sent = 0
+        self._server = ThreadingHTTPServer((host, 0), _SiteHandler)
+        self._server.daemon_threads = True
+        self._server.site = self
+        self.base_url = f'http://{host}:{self._server.server_port}'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='fakesite', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def watch_url(self, video_id):
+        return f'{self.base_url}/watch/{video_id}'
+
+
+def register_extractor():
+    """Register the yt-dlp extractor for FakeSite watch pages (idempotent)"""
+    from yt_dlp.extractor import extractors
+    from yt_dlp.extractor.common import InfoExtractor
+
+    if hasattr(extractors, 'BenchSiteIE'):
+        return extractors.BenchSiteIE
+
+    class BenchSiteIE(InfoExtractor):
+        IE_NAME = 'benchsite'
+        _VALID_URL = r'https?://(?:127\.0\.0\.1|localhost):\d+/watch/(?P<id>[\w-]+)'
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            page = self._download_json(url, video_id)
+            base = url.split('/watch/', 1)[0]
+            formats = []
+            for f in page['formats']:
+                f = dict(f)
+                f['url'] = f"{base}/{f.pop('path')}"
+                formats.append(f)
+            return {'id': page['id'], 'title': page['title'], 'duration': page.get('duration'), 'formats': formats}
+
+    extractors._ALL_CLASSES.insert(0, BenchSiteIE)
+    extractors.BenchSiteIE = BenchSiteIE
+    return BenchSiteIE
+
+
+class _SocksHandler(StreamRequestHandler):
+    def handle(self):
+        # Greeting: accept "no authentication" only
+        version, count = struct.unpack('!BB', self.rfile.read(2))
+        self.rfile.read(count)
+        if version != 5:
+            return
+        self.wfile.write(b'\x05\x00')
+
+        version, command, _, address_type = struct.unpack('!BBBB', self.rfile.read(4))
+        if address_type == 1:
+            host = socket.inet_ntoa(self.rfile.read(4))
+        elif address_type == 3:
+            host = self.rfile.read(self.rfile.read(1)[0]).decode()
+        else:
+            self.wfile.write(b'\x05\x08\x00\x01' + b'\x00' * 6)
+            return
+        port = struct.unpack('!H', self.rfile.read(2))[0]
+        if command != 1:
+            self.wfile.write(b'\x05\x07\x00\x01' + b'\x00' * 6)
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        try:
+            upstream = socket.create_connection((host, port), timeout=30)
+        except OSError:
+            self.wfile.write(b'\x05\x05\x00\x01' + b'\x00' * 6)
+            return
+        self.server.connections += 1
+        bound_host, bound_port = upstream.getsockname()[:2]
+        self.wfile.write(b'\x05\x00\x00\x01' + socket.inet_aton(bound_host) + struct.pack('!H', bound_port))
+        self.wfile.flush()
+        self._relay(self.connection, upstream)
+
+    def _relay(self, client, upstream):
+        sockets = [client, upstream]
+        try:
+            while True:
+                readable, _, _ = select.select(sockets, [], [], 60)
+                if not readable:
+                    return
+                for sock in readable:
+                    data = sock.recv(CHUNK_SIZE)
+                    if not data:
+                        return
+                    (upstream if sock is client else client).sendall(data)
+        except OSError:
+            pass
+        finally:
+            upstream.close()
+
+
+class SocksProxy:
+    """Minimal SOCKS5 relay (CONNECT, no authentication) with optional latency"""
+
+    def __init__(self, latency=0.0, host='127.0.0.1'):
+        self._server = ThreadingTCPServer((host, 0), _SocksHandler)
+        self._server.daemon_threads = True
+        self._server.latency = latency
+        self._server.connections = 0
+        self.url = f'socks5://{host}:{self._server.server_address[1]}'
+
+    @property
+    def connections(self):
+        return self._server.connections
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='socks', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
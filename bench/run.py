@@ -0,0 +1,479 @@
+# Offline load test
+#
+# Starts a FakeSite (and optionally SOCKS5 stand-ins), serves the app either
+# in this process or under gunicorn, and runs complete user flows against
+# it concurrently: get-info (polling while it is pending), download, status
+# polling and download-file. Reports latency percentiles per endpoint,
+# tasks per second, peak RSS of the server processes and disk usage of the
+# downloads directory.
+#
+#   python -m bench.run --tasks 40 --concurrency 8 --bandwidth 4M
+#   python -m bench.run --server gunicorn --workers 2 --socks 2 --json out.json
+
+import argparse
+import ast
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bench.fakesite import FakeSite, SocksProxy  # noqa: E402
+
+DOWNLOADS_DIR = os.path.join(ROOT, 'downloads')
+ENDPOINTS = ('get-info', 'download', 'status', 'download-file', 'task')
+READ_SIZE = 256 * 1024
+
+
+def parse_size(text):
+    """Parse 5M, 512K, 1.5G or a plain number of bytes"""
+    text = str(text).strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+
+def parse_override(text):
+    key, _, value = text.partition('=')
+    try:
+        return key, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return key, value
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {name: [] for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+        self.error_samples = []
+        self.bytes_received = 0
+        self.task_ids = []
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.latencies[name].append(seconds)
+
+    def error(self, name, message):
+        with self._lock:
+            self.errors[name] += 1
+            if len(self.error_samples) < 10:
+                self.error_samples.append(f'{name}: {message}')
+
+    def summary(self):
+        rows = {}
+        for name in ENDPOINTS:
+            values = sorted(self.latencies[name])
+            rows[name] = {
+                'count': len(values),
+                'errors': self.errors[name],
+                'p50_ms': _ms(percentile(values, 50)),
+                'p99_ms': _ms(percentile(values, 99)),
+                'max_ms': _ms(values[-1] if values else None),
+            }
+        return rows
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class Client:
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def request(self, method, path, body=None):
+        """Return (HTTP status, decoded JSON body)"""
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as e:
+            try:
+                return e.code, json.loads(e.read() or b'null')
+            except ValueError:
+                return e.code, None
+
+    def fetch(self, path):
+        """Download a body without keeping it; return (HTTP status, bytes read)"""
+        try:
+            with urllib.request.urlopen(self.base_url + path, timeout=self.timeout) as response:
+                received = 0
+                while True:
+                    chunk = response.read(READ_SIZE)
+                    if not chunk:
+                        return response.status, received
+                    received += len(chunk)
+        except urllib.error.HTTPError as e:
+            return e.code, 0
+
+
+def run_flow(client, recorder, url, args):
+    """One user: get-info, download, poll status, fetch the file"""
+    started = time.monotonic()
+
+    t0 = time.monotonic()
+    status, data = client.request('POST', '/api/get-info', {'url': url})
+    while status == 202:
+        time.sleep(args.poll_interval)
+        status, data = client.request('GET', f"/api/get-info/{data['job_id']}")
+    if status != 200 or not data or data.get('status') != 'success':
+        recorder.error('get-info', data.get('message') if data else f'HTTP {status}')
+        return False
+    recorder.add('get-info', time.monotonic() - t0)
+
+    formats = data['formats']
+    format_id = formats[min(args.format_index, len(formats) - 1)]['format_id']
+    t0 = time.monotonic()
+    status, data = client.request('POST', '/api/download',
+                                  dict({'url': url, 'format_id': format_id, 'title': ''}, **download_mode(args)))
+    if status != 200 or not data or not data.get('task_id'):
+        recorder.error('download', data.get('message') if data else f'HTTP {status}')
+        return False
+    recorder.add('download', time.monotonic() - t0)
+    task_id = data['task_id']
+    with recorder._lock:
+        recorder.task_ids.append(task_id)
+
+    deadline = time.monotonic() + args.task_timeout
+    while True:
+        t0 = time.monotonic()
+        status, data = client.request('GET', f'/api/status/{task_id}')
+        recorder.add('status', time.monotonic() - t0)
+        state = (data or {}).get('status')
+        if state == 'finished':
+            break
+        if state in ('error', 'cancelled', 'not_found') or time.monotonic() > deadline:
+            recorder.error('task', (data or {}).get('error') or state or 'timed out')
+            return False
+        time.sleep(args.poll_interval)
+
+    t0 = time.monotonic()
+    status, received = client.fetch(f'/api/download-file/{task_id}')
+    if status != 200 or not received:
+        recorder.error('download-file', f'HTTP {status}, {received} bytes')
+        return False
+    recorder.add('download-file', time.monotonic() - t0)
+    with recorder._lock:
+        recorder.bytes_received += received
+    recorder.add('task', time.monotonic() - started)
+    return True
+
+
+def download_mode(args):
+    """Audio-only and clip parameters of /api/download from the command line"""
+    mode = {}
+    if args.audio:
+        mode.update(mode='audio', audio_format=None if args.audio == 'native' else args.audio)
+    if args.clip:
+        mode['start'], _, mode['end'] = args.clip.partition('-')
+    return mode
+
+
+class InProcessServer:
+    """The app on a threaded werkzeug server inside this process"""
+
+    def __init__(self, site_url, overrides):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+        from bench.wsgi import load_app
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.webapp = load_app(site_url, overrides)
+        self._server = make_server('127.0.0.1', 0, self.webapp.app, threaded=True, request_handler=QuietHandler)
+        self.base_url = f'http://127.0.0.1:{self._server.server_port}'
+        threading.Thread(target=self._server.serve_forever, name='bench-server', daemon=True).start()
+
+    def pids(self):
+        return [os.getpid()]
+
+    def stop(self):
+        self._server.shutdown()
+
+
+class GunicornServer:
+    """The app under gunicorn, configured by gunicorn.conf.py plus workers/threads"""
+
+    def __init__(self, site_url, overrides, workers, threads, boot_timeout=60, env=None):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        env = dict(os.environ, BENCH_SITE_URL=site_url, BENCH_CONFIG=json.dumps(overrides), **(env or {}))
+        self.started = time.monotonic()
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers),
+             '--threads', str(threads), '-b', f'127.0.0.1:{port}', 'bench.wsgi:application'],
+            cwd=ROOT, env=env,
+        )
+        self.base_url = f'http://127.0.0.1:{port}'
+        self.boot_seconds = self._wait_ready(boot_timeout)
+
+    def _wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with status {self.process.returncode}')
+            try:
+                with urllib.request.urlopen(self.base_url + '/api/stats', timeout=2):
+                    return time.monotonic() - self.started
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f'gunicorn did not answer within {timeout} seconds')
+
+    def pids(self):
+        pids = [self.process.pid]
+        for name in os.listdir('/proc'):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f'/proc/{name}/stat', 'rb') as f:
+                    ppid = int(f.read().rsplit(b')', 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            if ppid == self.process.pid:
+                pids.append(int(name))
+        return pids
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def directory_bytes(path):
+    total = 0
+    try:
+        for entry in os.scandir(path):
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                pass
+    except OSError:
+        pass
+    return total
+
+
+class ResourceSampler:
+    """Samples server RSS and downloads directory size in the background"""
+
+    def __init__(self, pids, directory, interval=0.2):
+        self._pids = pids
+        self.directory = directory
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self.baseline_disk = directory_bytes(directory)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='bench-sampler', daemon=True)
+
+    def _sample(self):
+        pids = self._pids()
+        self.peak_rss = max(self.peak_rss, sum(rss_bytes(pid) for pid in pids))
+        self.peak_disk = max(self.peak_disk, directory_bytes(self.directory) - self.baseline_disk)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def remove_task_files(task_ids, directory):
+    owners = set(task_ids)
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.name.split('.', 1)[0] in owners:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def build_overrides(args, proxies):
+    overrides = {
+        'USE_PROXY': bool(proxies),
+        'PROXY_LIST': [p.url for p in proxies],
+        'PROXY_GROUPS': {},
+        'PROXY_AFFINITY': {},
+        'PROXY_PROBE_URL': None,
+        'LOG_LEVEL': args.log_level,
+    }
+    if args.server == 'gunicorn' and args.workers > 1:
+        # Status requests can land on any worker
+        overrides['TASK_STORE'] = 'sqlite'
+    overrides.update(dict(parse_override(item) for item in args.set))
+    return overrides
+
+
+def format_bytes(n):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(n) < 1024 or unit == 'GiB':
+            return f'{n:.1f} {unit}' if unit != 'B' else f'{n} B'
+        n /= 1024
+
+
+def print_report(report):
+    print()
+    print(f"{'endpoint':<15}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, row in report['endpoints'].items():
+        cells = [row[key] if row[key] is not None else '-' for key in ('p50_ms', 'p99_ms', 'max_ms')]
+        print(f"{name:<15}{row['count']:>7}{row['errors']:>8}{cells[0]:>10}{cells[1]:>10}{cells[2]:>10}")
+    print()
+    print(f"tasks:        {report['finished']} finished, {report['failed']} failed "
+          f"in {report['wall_seconds']:.1f}s ({report['tasks_per_second']:.2f} tasks/s)")
+    print(f"received:     {format_bytes(report['bytes_received'])} "
+          f"({format_bytes(report['bytes_received'] / max(report['wall_seconds'], 1e-9))}/s)")
+    print(f"peak RSS:     {format_bytes(report['peak_rss_bytes'])} over {report['server']['processes']} process(es)")
+    print(f"disk:         peak {format_bytes(report['peak_disk_bytes'])}, "
+          f"final {format_bytes(report['final_disk_bytes'])} above the starting size")
+    print(f"site:         {report['site']['pages_served']} pages, {format_bytes(report['site']['bytes_sent'])} sent")
+    if report['socks_connections'] is not None:
+        print(f"socks:        {report['socks_connections']} connection(s)")
+    for sample in report['error_samples']:
+        print(f"error:        {sample}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline load test for the video fetcher')
+    parser.add_argument('--tasks', type=int, default=20, help='user flows to run')
+    parser.add_argument('--concurrency', type=int, default=4, help='flows running at the same time')
+    parser.add_argument('--distinct', type=int, default=0,
+                        help='distinct videos requested (0 = every flow gets its own; lower exercises dedup)')
+    parser.add_argument('--format-index', type=int, default=0, help='entry of the offered format list to download')
+    parser.add_argument('--audio', choices=('native', 'm4a', 'opus'), help='download audio only, in this container')
+    parser.add_argument('--clip', metavar='START-END', help='download only this range, in seconds (e.g. 2-5)')
+    parser.add_argument('--video-size', type=parse_size, default='5M', help='size of the 720p stream')
+    parser.add_argument('--audio-size', type=parse_size, default='160K', help='size of the audio stream')
+    parser.add_argument('--bandwidth', type=parse_size, default='0', help='bytes/s per site connection (0 = unlimited)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added before every site response')
+    parser.add_argument('--socks', type=int, default=0, help='local SOCKS5 stand-ins to use as proxies')
+    parser.add_argument('--socks-latency', type=float, default=0.0, help='seconds added to every SOCKS connect')
+    parser.add_argument('--server', choices=('inprocess', 'gunicorn'), default='inprocess')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=16, help='gunicorn threads per worker')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='override a config.py setting, e.g. --set DOWNLOAD_WORKERS=4')
+    parser.add_argument('--poll-interval', type=float, default=0.2, help='seconds between status polls')
+    parser.add_argument('--task-timeout', type=float, default=300, help='seconds before a flow is failed')
+    parser.add_argument('--media-dir', default=os.path.join(tempfile.gettempdir(), 'videofetcher-bench-media'),
+                        help='cache of generated media files')
+    parser.add_argument('--log-level', default='WARNING', help='LOG_LEVEL for the app')
+    parser.add_argument('--keep', action='store_true', help='keep the downloaded files')
+    parser.add_argument('--json', metavar='PATH', help='also write the report as JSON')
+    args = parser.parse_args(argv)
+
+    if not shutil.which('ffmpeg'):
+        parser.error('ffmpeg is required to generate media and to merge downloads')
+
+    site = FakeSite(args.media_dir, args.video_size, args.audio_size, args.bandwidth, args.latency).start()
+    proxies = [SocksProxy(args.socks_latency).start() for _ in range(args.socks)]
+    overrides = build_overrides(args, proxies)
+    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+
+    if args.server == 'gunicorn':
+        server = GunicornServer(site.base_url, overrides, args.workers, args.threads)
+        print(f"gunicorn answered after {server.boot_seconds:.2f}s")
+    else:
+        server = InProcessServer(site.base_url, overrides)
+    sampler = ResourceSampler(server.pids, DOWNLOADS_DIR).start()
+
+    recorder = Recorder()
+    client = Client(server.base_url, timeout=args.task_timeout)
+    run_id = uuid.uuid4().hex[:8]
+    distinct = args.distinct or args.tasks
+    urls = [site.watch_url(f'{run_id}-{i % distinct}') for i in range(args.tasks)]
+    print(f"Running {args.tasks} flows, {args.concurrency} at a time, against {server.base_url}")
+
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(lambda url: run_flow(client, recorder, url, args), urls))
+        wall = time.monotonic() - started
+        sampler.stop()
+        final_disk = directory_bytes(DOWNLOADS_DIR) - sampler.baseline_disk
+        processes = len(server.pids())
+    finally:
+        server.stop()
+        for proxy in proxies:
+            proxy.stop()
+        site.stop()
+        if not args.keep:
+            remove_task_files(recorder.task_ids, DOWNLOADS_DIR)
+
+    finished = sum(1 for ok in outcomes if ok)
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('json',)},
+        'overrides': overrides,
+        'endpoints': recorder.summary(),
+        'finished': finished,
+        'failed': len(outcomes) - finished,
+        'wall_seconds': round(wall, 3),
+        'tasks_per_second': round(finished / wall, 3) if wall else 0,
+        'bytes_received': recorder.bytes_received,
+        'peak_rss_bytes': sampler.peak_rss,
+        'peak_disk_bytes': sampler.peak_disk,
+        'final_disk_bytes': final_disk,
+        'server': {'mode': args.server, 'processes': processes},
+        'site': {'pages_served': site.pages_served, 'bytes_sent': site.bytes_sent},
+        'socks_connections': sum(p.connections for p in proxies) if proxies else None,
+        'error_samples': recorder.error_samples,
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if not report['failed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
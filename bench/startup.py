@@ -0,0 +1,175 @@
+# Startup and memory benchmark
+#
+# Measures what a deploy or a worker restart costs: the time of a cold
+# 'import app' in a fresh interpreter (next to a cold 'import yt_dlp'), and
+# for gunicorn with preload_app on and off the time until the first answer
+# and the memory of each process, both right after boot and after every
+# worker has extracted a few videos. PSS and private memory come from
+# /proc/<pid>/smaps_rollup: RSS counts pages shared copy-on-write with the
+# master in every worker, PSS splits them between the processes sharing them.
+# The app is served through bench.wsgi, whose stand-in extractor makes every
+# worker import yt-dlp at boot even without preload_app.
+#
+#   python -m bench.startup --workers 4
+#   python -m bench.startup --workers 2 --runs 5 --json startup.json
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bench.fakesite import FakeSite  # noqa: E402
+from bench.run import Client, GunicornServer, format_bytes  # noqa: E402
+
+IMPORT_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+import {module}
+print(time.perf_counter() - started, 'yt_dlp' in sys.modules)
+"""
+
+
+def import_seconds(module, runs):
+    """Median wall time of 'import module' in a fresh interpreter"""
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module=module)],
+                                cwd=ROOT, check=True, capture_output=True, text=True)
+        seconds, loaded = output.stdout.split()
+        timings.append(float(seconds))
+    return {'seconds': round(statistics.median(timings), 3), 'loads_yt_dlp': loaded == 'True'}
+
+
+def memory(pid):
+    """RSS, PSS and private bytes of a process"""
+    values = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                    values[key] = int(rest.split()[0]) * 1024
+    except OSError:
+        return None
+    return {'rss': values.get('Rss', 0), 'pss': values.get('Pss', 0),
+            'private': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)}
+
+
+def snapshot(server):
+    master, *workers = server.pids()
+    return {'master': memory(master), 'workers': [m for m in map(memory, workers) if m]}
+
+
+def wait_for_workers(server, workers, timeout=60):
+    deadline = time.monotonic() + timeout
+    while len(server.pids()) < workers + 1:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f'only {len(server.pids()) - 1} of {workers} workers started')
+        time.sleep(0.1)
+    return time.monotonic() - server.started
+
+
+def warm_up(server, site, requests):
+    """Extract distinct videos until the requests have reached every worker"""
+    client = Client(server.base_url, timeout=60)
+
+    def get_info(i):
+        status, data = client.request('POST', '/api/get-info', {'url': site.watch_url(f'startup-{i}')})
+        while status == 202:
+            status, data = client.request('GET', f"/api/get-info/{data['job_id']}")
+        return status == 200
+
+    with ThreadPoolExecutor(max_workers=requests) as pool:
+        return sum(pool.map(get_info, range(requests)))
+
+
+def measure_gunicorn(site, workers, threads, preload, warmup):
+    overrides = {'USE_PROXY': False, 'PROXY_LIST': [], 'PROXY_PROBE_URL': None, 'LOG_LEVEL': 'WARNING'}
+    server = GunicornServer(site.base_url, overrides, workers, threads,
+                            env={'GUNICORN_PRELOAD': '1' if preload else '0'})
+    try:
+        result = {
+            'preload': preload,
+            'first_answer_seconds': round(server.boot_seconds, 3),
+            'all_workers_seconds': round(wait_for_workers(server, workers), 3),
+        }
+        # Let the workers finish booting before reading their memory
+        time.sleep(1)
+        result['boot'] = snapshot(server)
+        result['warmup_ok'] = warm_up(server, site, warmup)
+        result['warm'] = snapshot(server)
+        return result
+    finally:
+        server.stop()
+
+
+def _totals(snap):
+    processes = [snap['master']] + snap['workers']
+    return {key: sum(p[key] for p in processes if p) for key in ('rss', 'pss', 'private')}
+
+
+def print_report(report):
+    print()
+    for module, result in report['imports'].items():
+        loaded = ' (loads yt_dlp)' if result['loads_yt_dlp'] else ''
+        print(f"cold import {module:<8} {result['seconds'] * 1000:8.0f} ms{loaded}")
+    for result in report['gunicorn']:
+        print(f"\ngunicorn, preload_app {'on' if result['preload'] else 'off'}: first answer after "
+              f"{result['first_answer_seconds']:.2f}s, all workers after {result['all_workers_seconds']:.2f}s, "
+              f"{result['warmup_ok']} warm-up extractions")
+        print(f"  {'':<14} {'RSS':>10} {'PSS':>10} {'private':>10}")
+        for stage in ('boot', 'warm'):
+            snap = result[stage]
+            rows = [('master', snap['master'])] + [(f'worker {i}', m) for i, m in enumerate(snap['workers'])]
+            rows.append(('total', _totals(snap)))
+            for name, m in rows:
+                if m:
+                    print(f"  {stage + ' ' + name:<14} {format_bytes(m['rss']):>10} {format_bytes(m['pss']):>10} "
+                          f"{format_bytes(m['private']):>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Startup time and per-worker memory of the video fetcher')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--runs', type=int, default=3, help='cold imports to take the median of')
+    parser.add_argument('--warmup', type=int, default=0, help='extractions after boot (default: 4 per worker)')
+    parser.add_argument('--media-dir', default=os.path.join(tempfile.gettempdir(), 'videofetcher-bench-media'),
+                        help='cache of generated media files')
+    parser.add_argument('--json', metavar='PATH', help='also write the report as JSON')
+    args = parser.parse_args(argv)
+
+    if not shutil.which('ffmpeg'):
+        parser.error('ffmpeg is required to generate media')
+
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key != 'json'},
+        'imports': {module: import_seconds(module, args.runs) for module in ('yt_dlp', 'app')},
+        'gunicorn': [],
+    }
+    site = FakeSite(args.media_dir).start()
+    try:
+        for preload in (True, False):
+            report['gunicorn'].append(measure_gunicorn(site, args.workers, args.threads, preload,
+                                                       args.warmup or 4 * args.workers))
+    finally:
+        site.stop()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,40 @@
+# App entry point for benchmarks
+#
+# Loads the app against a FakeSite: config overrides are applied before app
+# is imported (it reads config at import time), the stand-in extractor is
+# registered and the site is reported as the 'bench' platform. Under
+# gunicorn the settings come from the environment set by bench/run.py:
+#
+#   BENCH_SITE_URL=http://127.0.0.1:PORT BENCH_CONFIG='{"DOWNLOAD_WORKERS": 4}' \
+#       gunicorn bench.wsgi:application
+
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bench.fakesite import register_extractor  # noqa: E402
+
+
+def load_app(site_url, overrides=None):
+    """Import the app configured for the benchmark and return the module"""
+    import config
+    for key, value in (overrides or {}).items():
+        setattr(config, key, value)
+    register_extractor()
+
+    import app as webapp
+    get_platform = webapp.get_platform
+
+    def bench_platform(url):
+        return 'bench' if url.startswith(site_url) else get_platform(url)
+
+    webapp.get_platform = bench_platform
+    return webapp
+
+
+if os.environ.get('BENCH_SITE_URL'):
+    application = load_app(os.environ['BENCH_SITE_URL'], json.loads(os.environ.get('BENCH_CONFIG', '{}'))).app
@@ -3,13 +3,15 @@
 # Proxy configurations
 # Update this list regularly as public proxies can change frequently
 # Format: 'protocol://ip:port'
-PROXY_LIST = [
+INDIA_PROXIES = [
     # India proxies (high priority for Indian content)
     'socks5://103.48.68.36:9050',
     'socks5://103.240.161.101:6667',
     'socks5://103.149.53.120:59166',
     'socks5://103.69.216.249:50820',
-    
+]
+
+GLOBAL_PROXIES = [
     # Global proxies (fallback)
     'socks5://51.79.52.80:3080',
     'socks5://195.154.255.118:15001',
@@ -19,11 +21,102 @@ PROXY_LIST = [
     'socks5://174.77.111.197:4145',
 ]
 
+PROXY_LIST = INDIA_PROXIES + GLOBAL_PROXIES
+
+# Named proxy groups, and which group to prefer per platform (as returned by
+# get_platform), e.g. {'youtube': 'india'}. Other proxies are only used when
+# no proxy of the preferred group is healthy.
+PROXY_GROUPS = {
+    'india': INDIA_PROXIES,
+    'global': GLOBAL_PROXIES,
+}
+PROXY_AFFINITY = {}
+
 # Proxy configuration
 USE_PROXY = True  # Set to False to disable proxy usage globally
 PROXY_TIMEOUT = 30  # Seconds to wait for proxy connection
+PROXY_MAX_ATTEMPTS = 3  # Proxies tried for one extraction or download before giving up
+PROXY_QUARANTINE_BASE = 30  # Seconds a failing proxy is skipped, doubled per consecutive failure
+PROXY_QUARANTINE_MAX = 600  # Upper bound for the quarantine backoff
+PROXY_PROBE_URL = None  # e.g. 'http://127.0.0.1:8081/health'; None disables background probing
+PROXY_PROBE_INTERVAL = 300  # Seconds between probe rounds
+PROXY_PROBE_TIMEOUT = 5  # Seconds before a probe counts as failed
 
 # Download settings
 DEFAULT_FORMAT = 'bestvideo+bestaudio/best'
 MERGE_OUTPUT_FORMAT = 'mp4'
-SOCKET_TIMEOUT = 30 
\ No newline at end of file
+SOCKET_TIMEOUT = 30 
+
+# Metadata cache settings
+INFO_CACHE_TTL = 600  # Seconds an extracted info dict stays reusable
+INFO_CACHE_MAX_ENTRIES = 256  # Oldest entries are dropped beyond this
+
+# Metadata extraction settings
+EXTRACTION_WORKERS = 4  # yt-dlp extractions running at the same time
+EXTRACTION_QUEUE_SIZE = 32  # Pending extractions beyond this are rejected with a 429
+EXTRACTION_DEADLINE = 90  # Seconds after which waiting requests give up on an extraction
+EXTRACTION_WAIT = 2  # Seconds /api/get-info (and /api/stream) waits before answering 202 (503) instead
+EXTRACTION_POLL_WAIT = 2  # Seconds a poll of /api/get-info/<job_id> waits for the result
+EXTRACTION_WAITERS = 4  # Request threads per worker waiting on extractions; others are answered straight away
+EXTRACTION_JOB_TTL = 300  # Seconds a finished extraction result can be polled
+
+# Download scheduler settings
+DOWNLOAD_WORKERS = 2  # Downloads (yt-dlp + ffmpeg merge) running at the same time
+DOWNLOAD_QUEUE_SIZE = 100  # Waiting downloads beyond this are rejected with a 429
+DOWNLOADS_PER_HOST = 2  # Downloads from the same site running at the same time (0 = no limit)
+CONCURRENT_FRAGMENTS = 4  # Fragments of a DASH/HLS stream fetched in parallel
+
+# Batch settings
+BATCH_MAX_ITEMS = 50  # URLs or playlist entries accepted in one /api/batch call
+
+# De-duplication settings
+ARTIFACT_TTL = 6 * 60 * 60  # Seconds a finished file is reused for identical requests
+
+# Task state settings
+# 'memory' keeps tasks in the serving process; 'sqlite' shares them between
+# gunicorn workers so status and file requests can land on any worker
+TASK_STORE = 'memory'
+TASK_STORE_PATH = 'downloads/tasks.sqlite3'
+PROGRESS_WRITE_INTERVAL = 0.5  # Minimum seconds between progress writes per task
+TASK_TTL = ARTIFACT_TTL  # Seconds a task is kept after its last change
+TASK_MAX_ENTRIES = 10000  # Oldest finished tasks are dropped beyond this
+
+# Progress stream (Server-Sent Events) settings
+SSE_POLL_INTERVAL = 1.0  # Seconds between task store re-reads when no local update arrives
+SSE_HEARTBEAT_INTERVAL = 15  # Seconds of silence before a keep-alive comment is sent
+SSE_MAX_DURATION = 600  # Seconds before a stream is closed and the browser reconnects
+# Each open stream holds a connection: a greenlet under gevent workers, a
+# thread under gthread ones. By default a worker lets streams take
+# SSE_CONNECTION_SHARE of its connections (or threads), leaving the rest for
+# page loads and file downloads. Clients turned away poll /api/status instead.
+SSE_MAX_CONNECTIONS = None  # Per worker process; a number overrides the sizing
+SSE_CONNECTION_SHARE = 0.5
+
+# Streaming mode settings
+STREAMING_ENABLED = True  # Allow /api/stream to mux straight into the response
+STREAM_MAX_CONCURRENT = 4  # ffmpeg processes streaming to clients at the same time
+
+# Storage settings
+STORAGE_BUDGET_BYTES = 5 * 1024 ** 3  # Size the downloads directory is kept under (0 = unlimited)
+STORAGE_FILE_TTL = ARTIFACT_TTL  # Seconds a finished file is kept at most
+STORAGE_PARTIAL_GRACE = 300  # Seconds since the last write before a partial file counts as abandoned
+STORAGE_SCAN_INTERVAL = 300  # Seconds between full scans of the directory (expiry, other workers' files)
+
+# File serving settings
+# 'direct' sends files from the app (Range requests, sendfile under gunicorn);
+# 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd) let the front
+# proxy send them
+FILE_SERVE_MODE = 'direct'
+X_ACCEL_REDIRECT_PREFIX = '/protected-downloads/'  # nginx internal location aliased to downloads/
+
+# Logging settings
+LOG_LEVEL = 'INFO'  # DEBUG also logs per-download details and yt-dlp's own output
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Download retry settings
+DOWNLOAD_RETRIES = 3  # Retries per task after a failed attempt, whatever the cause
+DOWNLOAD_RETRY_BASE = 2  # Seconds before the first retry; doubles with every retry
+DOWNLOAD_RETRY_MAX = 30  # Longest wait before a retry
+
+# Audio-only and clip settings
+CLIP_PRECISE_CUTS = False  # Re-encode around clip cuts for frame-exact clips; otherwise a clip starts at the keyframe before 'start'
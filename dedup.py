@@ -0,0 +1,193 @@
+# De-duplication of identical downloads
+#
+# Two requests for the same video in the same resolved format produce the
+# same bytes. While a download is running, later requests attach to it
+# (single-flight); once it has finished, its file is served from a
+# persistent artifact index until the entry expires.
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no gunicorn workers to share the index with
+    fcntl = None
+
+from formats import resolve_format
+from info_cache import normalize_url
+
+log = logging.getLogger(__name__)
+
+
+def make_key(url, info, format_spec, format_ids=None, variant=''):
+    """Build the de-duplication key for a request.
+
+    With metadata the key is the extractor's canonical video id plus the
+    resolved format (format_ids when the caller already resolved it);
+    without it we fall back to the normalized URL and the raw format
+    selector. variant tells apart outputs made differently from the same
+    formats (audio-only, clips).
+    """
+    suffix = f":{variant}" if variant else ''
+    if info and info.get('id') and info.get('extractor_key'):
+        format_part = format_ids
+        if not format_part:
+            try:
+                format_part = resolve_format(info, format_spec)
+            except Exception as e:
+                log.warning("Could not resolve format %s: %s", format_spec, e)
+                format_part = format_spec
+        return f"{info['extractor_key']}:{info['id']}:{format_part}{suffix}"
+    return f"url:{normalize_url(url)}:{format_spec}{suffix}"
+
+
+@contextmanager
+def _file_lock(path):
+    """Hold an exclusive lock on path against other processes"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ArtifactIndex:
+    """Persistent map from de-duplication key to a finished file on disk.
+
+    Every worker process reads and writes the same file; changes are made
+    under a file lock on the latest version, so concurrent writers do not
+    drop each other's entries.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._mtime = None
+        self._load()
+
+    def _load(self, force=False):
+        # Other worker processes write the same index file, so pick up their
+        # entries whenever it has changed on disk
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime and not force:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+            self._mtime = mtime
+        except (OSError, ValueError) as e:
+            log.warning("Could not read artifact index: %s", e)
+
+    def _save(self):
+        now = time.time()
+        self._entries = {k: v for k, v in self._entries.items() if v['expires'] > now}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+        except OSError as e:
+            log.warning("Could not write artifact index: %s", e)
+
+    def lookup(self, key):
+        """Return the stored entry for key if it is still valid, else None"""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires'] <= time.time() or not os.path.exists(entry['path']):
+                with _file_lock(f"{self.path}.lock"):
+                    self._load(force=True)
+                    self._entries.pop(key, None)
+                    self._save()
+                return None
+            return dict(entry)
+
+    def record(self, key, path, title=None):
+        with self._lock, _file_lock(f"{self.path}.lock"):
+            self._load(force=True)
+            self._entries[key] = {
+                'path': path,
+                'title': title,
+                'expires': time.time() + self.ttl,
+            }
+            self._save()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SingleFlight:
+    """Tracks the one task that is producing each key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leaders = {}
+        self._followers = {}
+
+    def join(self, key, task_id):
+        """Return the leader task id for key, or None if task_id becomes the leader"""
+        with self._lock:
+            leader = self._leaders.get(key)
+            if leader is None:
+                self._leaders[key] = task_id
+                self._followers[key] = []
+                return None
+            self._followers[key].append(task_id)
+            return leader
+
+    def followers(self, key):
+        """Task ids currently attached to the download of key"""
+        with self._lock:
+            return list(self._followers.get(key, ()))
+
+    def finish(self, key):
+        """Forget the in-flight entry for key and return its follower task ids"""
+        with self._lock:
+            self._leaders.pop(key, None)
+            return self._followers.pop(key, [])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._leaders)
+
+
+class DedupStats:
+    """Counts how often a request was served without a fresh download"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.artifact_hits = 0
+        self.coalesced = 0
+        self.fresh_downloads = 0
+
+    def record(self, kind):
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            reused = self.artifact_hits + self.coalesced
+            return {
+                'artifact_hits': self.artifact_hits,
+                'coalesced': self.coalesced,
+                'fresh_downloads': self.fresh_downloads,
+                'reuse_ratio': round(reused / self.fresh_downloads, 3) if self.fresh_downloads else float(reused),
+            }
@@ -0,0 +1,129 @@
+# Bounded download scheduler
+#
+# A fixed pool of worker threads pulls download jobs from a priority queue.
+# Jobs with the same priority run in FIFO order. Once the queue is full new
+# jobs are refused so the server never accepts work it cannot finish. Jobs
+# can carry a group (the source host) so that a batch aimed at one site
+# does not occupy every worker at once.
+
+import heapq
+import itertools
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted to a queue that is already at its bound"""
+
+
+class DownloadQueue:
+    def __init__(self, workers, max_queued, group_limit=0):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.group_limit = group_limit  # Running jobs per group, 0 = unlimited
+        self._heap = []
+        self._group_active = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self.active = 0
+
+    def _ensure_workers(self):
+        # Workers are started on first use rather than at import time so that
+        # they are created in the process that serves requests (gunicorn
+        # forks workers after importing the app).
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"download-worker-{i}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, task_id, fn, *args, priority=0, group=None):
+        """Queue fn(*args) for execution. Higher priority runs sooner."""
+        with self._cond:
+            if len(self._heap) >= self.max_queued:
+                raise QueueFull(f"Download queue is full ({self.max_queued} waiting)")
+            self._ensure_workers()
+            heapq.heappush(self._heap, (-priority, next(self._counter), task_id, group, fn, args))
+            self._cond.notify_all()
+
+    def cancel(self, task_id):
+        """Remove a waiting job; return False if it is not (or no longer) queued"""
+        with self._cond:
+            for entry in self._heap:
+                if entry[2] == task_id:
+                    self._heap.remove(entry)
+                    heapq.heapify(self._heap)
+                    return True
+        return False
+
+    def free_slots(self):
+        """Number of jobs that can still be queued"""
+        with self._cond:
+            return max(0, self.max_queued - len(self._heap))
+
+    def position(self, task_id):
+        """Return the 1-based queue position of a waiting task, or None"""
+        with self._cond:
+            for index, entry in enumerate(sorted(self._heap)):
+                if entry[2] == task_id:
+                    return index + 1
+        return None
+
+    def _group_full(self, group):
+        if not self.group_limit or group is None:
+            return False
+        return self._group_active.get(group, 0) >= self.group_limit
+
+    def _next_job(self):
+        # Highest priority job whose group still has room; jobs of a busy
+        # group keep their place for when a slot frees up
+        if not self._heap:
+            return None
+        if not self._group_full(self._heap[0][3]):
+            return heapq.heappop(self._heap)
+        for entry in sorted(self._heap):
+            if not self._group_full(entry[3]):
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+                return entry
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                entry = self._next_job()
+                while entry is None:
+                    self._cond.wait()
+                    entry = self._next_job()
+                _, _, task_id, group, fn, args = entry
+                self.active += 1
+                if group is not None:
+                    self._group_active[group] = self._group_active.get(group, 0) + 1
+            try:
+                fn(*args)
+            except Exception:
+                log.exception("Unhandled error in download worker for task %s", task_id)
+            finally:
+                with self._cond:
+                    self.active -= 1
+                    if group is not None:
+                        self._group_active[group] -= 1
+                        if not self._group_active[group]:
+                            del self._group_active[group]
+                    # A job held back by its group limit may be runnable now
+                    self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'active': self.active,
+                'queued': len(self._heap),
+                'max_queued': self.max_queued,
+                'active_per_group': dict(self._group_active),
+            }
@@ -0,0 +1,139 @@
+# Bounded pool for metadata extraction off the request threads, with one shared
+# job per URL and a deadline per job
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+
+class ExtractionBusy(Exception):
+    """Too many extractions are already waiting"""
+
+
+class ExtractionTimeout(Exception):
+    """The extraction did not finish before its deadline"""
+
+
+class ExtractionJob:
+    def __init__(self, key, args, deadline):
+        self.job_id = str(uuid.uuid4())
+        self.key = key
+        self.args = args
+        self.deadline = deadline
+        self.future = None
+        self.finished_at = None
+        # Set once the caller also keeps the outcome outside this process
+        self.shared = False
+
+
+class ExtractionPool:
+    def __init__(self, workers, max_pending, deadline, job_ttl=300):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.deadline = deadline
+        self.job_ttl = job_ttl
+        self._lock = threading.Lock()
+        self._executor = None
+        self._jobs = {}
+        self._inflight = {}
+        self.timeouts = 0
+        self.cancelled = 0
+
+    def submit(self, key, fn, *args):
+        """Start fn(*args) for key, or return the job already running for it.
+
+        Raises ExtractionBusy when max_pending jobs are queued or running.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            job = self._jobs.get(self._inflight.get(key))
+            if job is not None and not job.future.done() and now < job.deadline:
+                return job
+            pending = sum(1 for j in self._jobs.values() if not j.future.done())
+            if pending >= self.max_pending:
+                raise ExtractionBusy(f"{pending} extractions are already pending")
+
+            if self._executor is None:
+                # Threads start on first use, after gunicorn has forked
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='extract')
+            job = ExtractionJob(key, args, now + self.deadline)
+            job.future = self._executor.submit(self._run, job, fn, args)
+            self._jobs[job.job_id] = job
+            self._inflight[key] = job.job_id
+        # Outside the lock: the callback runs right here if the job is done
+        job.future.add_done_callback(lambda _: self._finish(job))
+        return job
+
+    def _run(self, job, fn, args):
+        if time.monotonic() >= job.deadline:
+            # Waited in the queue past its deadline; nobody wants it any more
+            raise ExtractionTimeout("Extraction did not start before its deadline")
+        return fn(*args)
+
+    def _finish(self, job):
+        with self._lock:
+            job.finished_at = time.monotonic()
+            if self._inflight.get(job.key) == job.job_id:
+                del self._inflight[job.key]
+
+    def _prune(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.job_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job, timeout=None):
+        """Wait up to timeout seconds (never past the job's deadline).
+
+        Returns the result, or None if the job is still running. Raises the
+        job's exception, ExtractionTimeout once the deadline has passed, or
+        CancelledError.
+        """
+        remaining = job.deadline - time.monotonic()
+        if timeout is not None:
+            remaining = min(remaining, timeout)
+        try:
+            return job.future.result(timeout=max(0, remaining))
+        except FutureTimeout:
+            if time.monotonic() < job.deadline:
+                return None
+            # A running yt-dlp call cannot be interrupted; drop the job so
+            # later requests start afresh, and let it finish in the background
+            with self._lock:
+                if self._inflight.get(job.key) == job.job_id:
+                    del self._inflight[job.key]
+                    self.timeouts += 1
+            job.future.cancel()
+            raise ExtractionTimeout(f"Extraction did not finish within {self.deadline} seconds")
+
+    def run(self, key, fn, *args):
+        """Submit (or join) an extraction and block until it finishes or times out"""
+        return self.wait(self.submit(key, fn, *args))
+
+    def cancel(self, job_id):
+        """Cancel a job that has not started yet; return True if it was cancelled"""
+        job = self.get(job_id)
+        if job is None or not job.future.cancel():
+            return False
+        with self._lock:
+            self.cancelled += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if not j.future.done())
+            return {
+                'workers': self.workers,
+                'pending': pending,
+                'max_pending': self.max_pending,
+                'jobs': len(self._jobs),
+                'timeouts': self.timeouts,
+                'cancelled': self.cancelled,
+            }
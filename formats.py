@@ -0,0 +1,252 @@
+# Format resolution and output planning
+#
+# Turn a yt-dlp format selector ('bestvideo[height<=720]+bestaudio/best')
+# into the concrete formats it picks from an already extracted info dict,
+# without touching the network, and decide how ffmpeg has to turn them into
+# an MP4: a stream-copy remux whenever the codecs allow it, a transcode only
+# when they do not. Audio-only downloads are planned the same way against an
+# m4a or opus file. build_ladder() produces the quality menu shown to the
+# user from a single pass over the formats.
+
+import copy
+
+import ytdl
+
+# Same order as yt-dlp's default sort, except that at equal resolution and
+# frame rate codecs that play everywhere in MP4 win
+MP4_FORMAT_SORT = ['lang', 'quality', 'res', 'fps', 'vcodec:h264', 'acodec:aac']
+
+# Codec prefixes ffmpeg can stream-copy into an MP4 container
+MP4_VIDEO_CODECS = ('avc1', 'avc3', 'h264', 'hvc1', 'hev1', 'h265', 'hevc', 'av01', 'vp09', 'vp9')
+MP4_AUDIO_CODECS = ('mp4a', 'aac', 'mp3', 'opus', 'ac-3', 'ec-3', 'flac', 'alac')
+
+# Audio-only containers and the codec prefixes ffmpeg can stream-copy into them
+AUDIO_CONTAINER_CODECS = {
+    'm4a': ('mp4a', 'aac', 'alac'),
+    'opus': ('opus',),
+}
+
+# Resolutions offered in the quality menu
+LADDER_HEIGHTS = (360, 480, 720, 1080)
+
+
+def select_formats(info, format_spec, format_sort=MP4_FORMAT_SORT):
+    """Return the list of format dicts a selector picks (one per stream)"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'format': format_spec,
+        'format_sort': format_sort,
+    }
+    with ytdl.pool.borrow(ydl_opts) as ydl:
+        resolved = ydl.process_ie_result(copy.deepcopy(info), download=False)
+    return resolved.get('requested_formats') or [resolved]
+
+
+def resolve_format(info, format_spec):
+    """Return the concrete format ids (e.g. '137+140') a selector picks from info"""
+    return '+'.join(f.get('format_id') or '' for f in select_formats(info, format_spec)) or format_spec
+
+
+def _codec_fits(codec, allowed):
+    if not codec or codec == 'none':
+        return True
+    return codec.lower().startswith(allowed)
+
+
+def plan_output(info, format_spec, output_format='mp4'):
+    """Decide how the selected formats become an output_format file.
+
+    Returns a dict with the chosen formats, their codecs and the ffmpeg
+    path: 'none' (the download already is the output), 'copy' (merge or
+    remux with stream copy) or 'transcode' (re-encode is unavoidable).
+    """
+    selected = select_formats(info, format_spec)
+    vcodec = next((f.get('vcodec') for f in selected if f.get('vcodec') not in (None, 'none')), None)
+    acodec = next((f.get('acodec') for f in selected if f.get('acodec') not in (None, 'none')), None)
+
+    if not (_codec_fits(vcodec, MP4_VIDEO_CODECS) and _codec_fits(acodec, MP4_AUDIO_CODECS)):
+        path = 'transcode'
+    elif len(selected) > 1 or selected[0].get('ext') != output_format:
+        path = 'copy'
+    else:
+        path = 'none'
+
+    return {
+        'format_id': '+'.join(f.get('format_id') or '' for f in selected),
+        'formats': selected,
+        'vcodec': vcodec,
+        'acodec': acodec,
+        'path': path,
+        # Expected download size, 0 when the extractor does not know it
+        'filesize': sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in selected),
+    }
+
+
+def apply_plan(ydl_opts, plan, output_format='mp4'):
+    """Set the yt-dlp post-processing options that carry out a plan"""
+    ydl_opts['format_sort'] = MP4_FORMAT_SORT
+    ydl_opts['merge_output_format'] = output_format
+    if plan['path'] == 'transcode':
+        # Merge into a container that accepts any codec, then convert once
+        if len(plan['formats']) > 1:
+            ydl_opts['merge_output_format'] = 'mkv'
+        ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoConvertor', 'preferedformat': output_format}]
+    elif plan['path'] == 'copy':
+        # The merger already stream-copies into output_format; the remuxer
+        # covers a single stream in another container and is a no-op otherwise
+        ydl_opts['postprocessors'] = [{'key': 'FFmpegVideoRemuxer', 'preferedformat': output_format}]
+    else:
+        ydl_opts['postprocessors'] = []
+    return ydl_opts
+
+
+def audio_format_sort(container=None):
+    """Format sort for audio-only downloads: prefer a codec the container takes as it is"""
+    codec = {'m4a': 'aac', 'opus': 'opus'}.get(container)
+    return ['lang', 'quality', f'acodec:{codec}', 'abr'] if codec else ['lang', 'quality', 'abr']
+
+
+def plan_audio(info, format_spec, container=None):
+    """Decide how the selected format becomes an audio-only file.
+
+    container is 'm4a' or 'opus', or None to keep the downloaded audio in
+    its own container. Returns a dict like plan_output(); 'copy' means the
+    audio is pulled out of its container without re-encoding it.
+    """
+    selected = select_formats(info, format_spec, audio_format_sort(container))
+    fmt = selected[0]
+    acodec = fmt.get('acodec') if _has_codec(fmt.get('acodec')) else None
+    # bestaudio/best falls back to a format with video when there is no
+    # audio-only one
+    has_video = any(_has_codec(f.get('vcodec')) for f in selected)
+
+    if container is None:
+        path = 'copy' if has_video else 'none'
+    elif not _codec_fits(acodec, AUDIO_CONTAINER_CODECS[container]):
+        path = 'transcode'
+    elif has_video or len(selected) > 1 or fmt.get('ext') != container:
+        path = 'copy'
+    else:
+        path = 'none'
+
+    return {
+        'format_id': '+'.join(f.get('format_id') or '' for f in selected),
+        'formats': selected,
+        'vcodec': None,
+        'acodec': acodec,
+        'path': path,
+        'filesize': sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in selected),
+    }
+
+
+def audio_postprocessors(container=None):
+    """yt-dlp post-processing that leaves only the audio, stream-copied when the codec allows"""
+    return [{'key': 'FFmpegExtractAudio', 'preferredcodec': container or 'best'}]
+
+
+def apply_audio_plan(ydl_opts, plan, container=None):
+    """Set the yt-dlp options that carry out a plan_audio() plan"""
+    ydl_opts['format_sort'] = audio_format_sort(container)
+    ydl_opts['postprocessors'] = [] if plan['path'] == 'none' else audio_postprocessors(container)
+    return ydl_opts
+
+
+def _filesize(fmt):
+    return fmt.get('filesize') or fmt.get('filesize_approx') or 0
+
+
+def _has_codec(codec):
+    return codec not in (None, 'none')
+
+
+def _video_rank(fmt):
+    # Within one height, close to what MP4_FORMAT_SORT picks: video-only
+    # streams (bestvideo), then frame rate, then H.264, then bitrate
+    vcodec = (fmt.get('vcodec') or '').lower()
+    return (
+        not _has_codec(fmt.get('acodec')),
+        fmt.get('fps') or 0,
+        vcodec.startswith(('avc1', 'avc3', 'h264')),
+        fmt.get('tbr') or 0,
+    )
+
+
+def _audio_rank(fmt):
+    acodec = (fmt.get('acodec') or '').lower()
+    return (acodec.startswith(('mp4a', 'aac')), fmt.get('abr') or fmt.get('tbr') or 0)
+
+
+def _ladder_option(format_id, label, video, audio):
+    size = _filesize(video)
+    if size and audio is not None and not _has_codec(video.get('acodec')):
+        size += _filesize(audio)
+    return {
+        'format_id': format_id,
+        'label': label,
+        'height': video.get('height'),
+        'fps': video.get('fps'),
+        'vcodec': video.get('vcodec'),
+        'acodec': video.get('acodec') if _has_codec(video.get('acodec')) else (audio or {}).get('acodec'),
+        'filesize': size or None,  # Estimate; None when the site does not say
+        'audio_only': False,
+    }
+
+
+def build_ladder(info):
+    """Return the quality options for an info dict.
+
+    Each option carries the format selector the download uses, a label and
+    what the selector is expected to pick: height, fps, codecs and the
+    estimated size of video plus audio. An audio-only option comes last.
+    """
+    best_video = {}  # height -> best format with video at that height
+    best_audio = None
+    for fmt in info.get('formats') or ():
+        height = fmt.get('height') or 0
+        if height > 0:
+            current = best_video.get(height)
+            if current is None or _video_rank(fmt) > _video_rank(current):
+                best_video[height] = fmt
+        elif not _has_codec(fmt.get('vcodec')) and _has_codec(fmt.get('acodec')):
+            if best_audio is None or _audio_rank(fmt) > _audio_rank(best_audio):
+                best_audio = fmt
+
+    heights = sorted(best_video)
+    if not heights:
+        # Nothing to go by: offer the standard resolutions
+        ladder = [{'format_id': 'bestvideo+bestaudio/best', 'label': 'Best quality'}]
+        ladder += [{
+            'format_id': f'bestvideo[height<={height}]+bestaudio/best[height<={height}]',
+            'label': f"{height}p",
+        } for height in LADDER_HEIGHTS]
+    else:
+        ladder = [_ladder_option('bestvideo+bestaudio/best', 'Best quality', best_video[heights[-1]], best_audio)]
+        # One option per target, for the highest available height not above
+        # it; heights is sorted, so a single pointer walks it once
+        index = 0
+        added = set()
+        for target in LADDER_HEIGHTS:
+            while index < len(heights) and heights[index] <= target:
+                index += 1
+            if index == 0 or heights[index - 1] in added:
+                continue
+            height = heights[index - 1]
+            added.add(height)
+            ladder.append(_ladder_option(
+                f'bestvideo[height<={target}]+bestaudio/best[height<={target}]',
+                f"{target}p",
+                best_video[height],
+                best_audio,
+            ))
+
+    if best_audio is not None:
+        ladder.append({
+            'format_id': 'bestaudio',
+            'label': 'Audio only',
+            'acodec': best_audio.get('acodec'),
+            'abr': best_audio.get('abr'),
+            'filesize': _filesize(best_audio) or None,
+            'audio_only': True,
+        })
+    return ladder
@@ -0,0 +1,49 @@
+# Gunicorn settings, picked up automatically when gunicorn starts in this directory
+import os
+
+# Progress streams hold a connection open for the length of a download.
+# gevent workers serve each connection in a greenlet, so an open stream costs
+# a few kB instead of one of a handful of threads. GUNICORN_WORKER_CLASS=gthread
+# goes back to threads (then GUNICORN_THREADS bounds the open streams).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+if worker_class == 'gevent':
+    # Patch before the app is preloaded, so the locks, queues and threads it
+    # creates at import are gevent's
+    from gevent import monkey
+    monkey.patch_all()
+
+# Load the app once in the master and fork workers from it, so they share
+# its memory (yt-dlp alone is tens of MB) copy-on-write instead of each
+# importing it. Set GUNICORN_PRELOAD=0 to load the app in every worker.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+
+def post_worker_init(worker):
+    # Cap the progress streams at what this worker can hold open
+    import app
+    app.size_progress_streams(worker.cfg.worker_class_str, worker.cfg.worker_connections, worker.cfg.threads)
+
+
+def on_starting(server):
+    # Runs in the master before the first workers are forked
+    if server.cfg.preload_app:
+        import ytdl
+        ffmpeg = ytdl.preload()
+        if ffmpeg['available']:
+            server.log.info("Preloaded yt-dlp; ffmpeg %s at %s", ffmpeg['ffmpeg'], ffmpeg['path'])
+        else:
+            server.log.warning("Preloaded yt-dlp; ffmpeg is not available, merging will not work")
+        # gevent's subprocess leaves the check's processes (ffmpeg, ldconfig)
+        # unreaped, and the arbiter would report them as dead workers. There
+        # are no workers yet, so every exited child is one of them.
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:
+                break
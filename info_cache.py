@@ -0,0 +1,139 @@
+# Metadata cache for yt-dlp extraction results, keyed by normalized URL, with
+# the proxy that produced each entry and a TTL
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+import ytdl
+
+# Query parameters that never change which video a URL points to
+TRACKING_PARAMS = {'si', 'feature', 'fbclid', 'igshid', 'igsh', 'ref', 'ref_src', 's', 't'}
+
+
+def normalize_url(url):
+    """Return a canonical form of a video URL for use as a cache key"""
+    try:
+        parsed = urlparse(url.strip())
+    except ValueError:
+        return url
+
+    scheme = (parsed.scheme or 'https').lower()
+    if scheme == 'http':
+        scheme = 'https'
+    host = parsed.netloc.lower()
+    for prefix in ('www.', 'm.', 'mobile.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+
+    path = parsed.path.rstrip('/') or '/'
+    query = [(k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+             if k not in TRACKING_PARAMS and not k.startswith('utm_')]
+
+    # youtu.be/<id> and youtube.com/shorts/<id> are the same as watch?v=<id>
+    if host == 'youtu.be' and len(path) > 1:
+        query.append(('v', path[1:]))
+        host, path = 'youtube.com', '/watch'
+    elif host == 'youtube.com' and path.startswith('/shorts/'):
+        query.append(('v', path[len('/shorts/'):]))
+        path = '/watch'
+
+    return urlunparse((scheme, host, path, '', urlencode(sorted(query)), ''))
+
+
+class InfoCache:
+    """TTL'd, size-bounded LRU cache of extracted info dicts"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.plan_hits = 0
+        self.plan_misses = 0
+
+    def get(self, url):
+        """Return (info, proxy) for a URL, or (None, None) on a miss.
+
+        The returned info dict is a private copy: yt-dlp mutates the dict it
+        processes, so callers may hand it straight to process_ie_result.
+        """
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['expires'] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            info, proxy = entry['info'], entry['proxy']
+        return copy.deepcopy(info), proxy
+
+    def put(self, url, info, proxy=None):
+        """Store a freshly extracted info dict for a URL.
+
+        Returns a private copy of the sanitized dict, like get() does.
+        """
+        if not info:
+            return info
+        # Drop runtime-only keys (requested_downloads, filepath, ...) so the
+        # cached dict can be reprocessed with a different format selector
+        clean = ytdl.load().YoutubeDL.sanitize_info(info, remove_private_keys=True)
+        key = normalize_url(url)
+        with self._lock:
+            self._entries[key] = {
+                'info': clean,
+                'proxy': proxy,
+                'expires': time.monotonic() + self.ttl,
+                'plans': {},
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return copy.deepcopy(clean)
+
+    def get_plan(self, url, name):
+        """Return a plan derived from the cached info of a URL (format ladder,
+        resolved format selector), or None. Plans are shared: don't modify them."""
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            plan = None
+            if entry is not None and entry['expires'] > time.monotonic():
+                plan = entry['plans'].get(name)
+            if plan is None:
+                self.plan_misses += 1
+            else:
+                self.plan_hits += 1
+            return plan
+
+    def put_plan(self, url, name, plan):
+        """Store a plan next to the cached info; it expires with it"""
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['plans'][name] = plan
+
+    def invalidate(self, url):
+        with self._lock:
+            self._entries.pop(normalize_url(url), None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'plan_hits': self.plan_hits,
+                'plan_misses': self.plan_misses,
+            }
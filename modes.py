@@ -0,0 +1,109 @@
+# Download modes: audio-only (bestaudio, optionally stream-copied into m4a or
+# opus) and clips of a time range fetched through yt-dlp's download_ranges
+
+import math
+
+import ytdl
+from formats import AUDIO_CONTAINER_CODECS
+
+AUDIO_FORMAT = 'bestaudio/best'
+
+
+class InvalidMode(ValueError):
+    """The request asked for a mode that does not make sense"""
+
+
+def parse_time(value):
+    """Seconds from a number or an '[[HH:]MM:]SS' string; None when empty"""
+    if value is None or value == '':
+        return None
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            seconds = float(value)
+        else:
+            parts = str(value).strip().split(':')
+            if len(parts) > 3:
+                raise ValueError(value)
+            seconds = 0.0
+            for part in parts:
+                seconds = seconds * 60 + float(part)
+    except ValueError:
+        raise InvalidMode(f"Invalid time: {value}")
+    if seconds < 0 or not math.isfinite(seconds):
+        raise InvalidMode(f"Invalid time: {value}")
+    return seconds
+
+
+def parse_mode(params):
+    """Read mode, audio_format, start and end from request parameters.
+
+    Returns None for a plain full-video download, otherwise a dict with
+    'audio' (bool), 'audio_format' ('m4a', 'opus' or None to keep the
+    downloaded container), 'start' and 'end' (seconds, None without a
+    clip). Raises InvalidMode.
+    """
+    name = params.get('mode') or 'video'
+    if name not in ('video', 'audio'):
+        raise InvalidMode("mode must be 'video' or 'audio'")
+    audio_format = params.get('audio_format') or None
+    if audio_format is not None and (name != 'audio' or audio_format not in AUDIO_CONTAINER_CODECS):
+        raise InvalidMode(f"audio_format must be one of {', '.join(AUDIO_CONTAINER_CODECS)} with mode 'audio'")
+
+    start, end = parse_time(params.get('start')), parse_time(params.get('end'))
+    if start is not None and end is None:
+        raise InvalidMode("A clip needs an end time")
+    if end is not None:
+        start = start or 0.0
+        if end <= start:
+            raise InvalidMode("The clip must end after it starts")
+
+    if name == 'video' and end is None:
+        return None
+    return {'audio': name == 'audio', 'audio_format': audio_format, 'start': start, 'end': end}
+
+
+def is_audio(mode):
+    return bool(mode and mode['audio'])
+
+
+def is_clip(mode):
+    return bool(mode and mode['end'] is not None)
+
+
+def mode_key(mode):
+    """The part of the de-duplication key that sets a mode apart ('' for a full video)"""
+    parts = []
+    if is_audio(mode):
+        parts.append(f"audio-{mode['audio_format'] or 'native'}")
+    if is_clip(mode):
+        parts.append(f"clip-{mode['start']:g}-{mode['end']:g}")
+    return '+'.join(parts)
+
+
+def check_clip(mode, info):
+    """Raise InvalidMode when a clip starts after the end of the video"""
+    duration = (info or {}).get('duration')
+    if is_clip(mode) and duration and mode['start'] >= duration:
+        raise InvalidMode(f"The clip starts after the end of the video ({duration:g}s)")
+
+
+def apply_clip(ydl_opts, mode, precise=False):
+    """Make yt-dlp download only the clip's time range.
+
+    Without precise cuts the clip starts at the keyframe before 'start' and
+    is stream-copied; with them ffmpeg re-encodes around the cuts.
+    """
+    if not is_clip(mode):
+        return ydl_opts
+    ydl_opts['download_ranges'] = ytdl.load().utils.download_range_func(None, [(mode['start'], mode['end'])])
+    ydl_opts['force_keyframes_at_cuts'] = precise
+    return ydl_opts
+
+
+def expected_size(mode, info, filesize):
+    """Scale the expected size of the full download down to the clip"""
+    duration = (info or {}).get('duration')
+    if not is_clip(mode) or not duration or not filesize:
+        return filesize
+    covered = max(0.0, min(mode['end'], duration) - mode['start'])
+    return int(filesize * min(1.0, covered / duration))
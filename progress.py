@@ -0,0 +1,151 @@
+# Download progress telemetry
+#
+# yt-dlp calls its progress hook for every chunk it writes. ProgressTracker
+# keeps the numeric counters of each stream (video and audio are downloaded
+# separately for 'bestvideo+bestaudio'), and only produces a task update when
+# one is due, so the cost of the hook does not grow with the chunk count.
+
+import time
+
+# Post-processors that run without ffmpeg
+NON_FFMPEG_POSTPROCESSORS = {'MoveFiles', 'MoveFilesAfterDownload'}
+
+
+class ProgressTracker:
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.streams = {}
+        # Number of streams the download fetches, once expect() knows it
+        self.expected = 0
+        self.last_publish = 0.0
+        self.postprocess_started = None
+        self.postprocess_seconds = 0.0
+        self.ffmpeg_seconds = 0.0
+        self.merge_seconds = 0.0
+        # Wall-clock span of the media transfer, for throughput metrics
+        self.transfer_started = None
+        self.transfer_finished = None
+
+    def expect(self, formats):
+        """Register the streams of the download with their expected sizes.
+
+        The hook only describes the stream being downloaded, so without this
+        the overall figure would restart when the second stream begins and
+        the end of the first stream would look like the end of the transfer.
+        """
+        self.streams = {
+            f.get('format_id') or 'default': {
+                'downloaded': 0,
+                'total': f.get('filesize') or f.get('filesize_approx') or 0,
+                'done': False,
+            }
+            for f in formats
+        }
+        self.expected = len(self.streams)
+
+    def _stream(self, info):
+        key = info.get('format_id') or info.get('_filename') or 'default'
+        stream = self.streams.get(key)
+        if stream is None:
+            parts = key.split('+')
+            if len(parts) > 1 and all(part in self.streams for part in parts):
+                # ffmpeg fetches the streams of a clip in one go
+                merged = [self.streams.pop(part) for part in parts]
+                stream = {'downloaded': 0, 'total': sum(s['total'] for s in merged), 'done': False}
+                self.expected -= len(parts) - 1
+            else:
+                stream = {'downloaded': 0, 'total': 0, 'done': False}
+            self.streams[key] = stream
+        return stream
+
+    def on_download(self, d):
+        """Record a yt-dlp progress hook call; return task fields when an update is due"""
+        stream = self._stream(d.get('info_dict') or {})
+        status = d['status']
+        if self.transfer_started is None:
+            self.transfer_started = time.monotonic()
+        if status == 'downloading':
+            stream['downloaded'] = d.get('downloaded_bytes') or 0
+            stream['total'] = d.get('total_bytes') or d.get('total_bytes_estimate') or stream['total']
+            now = time.monotonic()
+            if now - self.last_publish < self.min_interval:
+                return None
+            self.last_publish = now
+            fields = self._overall()
+            speed = d.get('speed')
+            fields['speed'] = int(speed) if speed else None
+            remaining = fields['total_bytes'] - fields['downloaded_bytes']
+            fields['eta'] = int(remaining / speed) if speed and remaining > 0 else d.get('eta')
+            return fields
+
+        if status == 'finished':
+            stream['done'] = True
+            stream['downloaded'] = d.get('total_bytes') or d.get('downloaded_bytes') or stream['downloaded']
+            # A clip ends well short of the full stream's size
+            stream['total'] = stream['downloaded']
+            fields = self._overall()
+            fields['speed'] = None
+            fields['eta'] = None
+            finished = sum(1 for s in self.streams.values() if s['done'])
+            if finished == len(self.streams) and finished >= self.expected:
+                self.transfer_finished = time.monotonic()
+                fields['status'] = 'processing'
+                fields['phase'] = 'processing'
+                fields['progress'] = 100
+            filename = d.get('filename')
+            if filename:
+                fields['filename'] = filename
+            self.last_publish = time.monotonic()
+            return fields
+
+        return None
+
+    def on_postprocess(self, d):
+        """Record a yt-dlp postprocessor hook call (merge, remux, convert)"""
+        name = d.get('postprocessor') or ''
+        phase = 'merging' if name == 'Merger' else 'postprocessing'
+        if d['status'] == 'started':
+            self.postprocess_started = time.monotonic()
+            return {'status': 'processing', 'phase': phase, 'postprocessor': name}
+        if d['status'] == 'finished' and self.postprocess_started is not None:
+            elapsed = time.monotonic() - self.postprocess_started
+            self.postprocess_seconds += elapsed
+            if name == 'Merger':
+                self.merge_seconds += elapsed
+            if name not in NON_FFMPEG_POSTPROCESSORS:
+                self.ffmpeg_seconds += elapsed
+            self.postprocess_started = None
+            fields = {
+                'postprocess_seconds': round(self.postprocess_seconds, 3),
+                'ffmpeg_seconds': round(self.ffmpeg_seconds, 3),
+            }
+            filepath = (d.get('info_dict') or {}).get('filepath')
+            if filepath:
+                fields['filename'] = filepath
+            return fields
+        return None
+
+    def transfer_rate(self):
+        """Return (bytes, bytes per second) of the finished transfer, or None"""
+        if self.transfer_started is None or self.transfer_finished is None:
+            return None
+        downloaded = sum(s['downloaded'] for s in self.streams.values())
+        elapsed = self.transfer_finished - self.transfer_started
+        if not downloaded or elapsed <= 0:
+            return None
+        return downloaded, downloaded / elapsed
+
+    def _overall(self):
+        downloaded = sum(s['downloaded'] for s in self.streams.values())
+        total = sum(max(s['total'], s['downloaded']) for s in self.streams.values())
+        progress = round(min(100.0, downloaded * 100 / total), 1) if total else 0
+        return {
+            'progress': progress,
+            'phase': 'downloading',
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'streams': {
+                key: round(s['downloaded'] * 100 / s['total'], 1) if s['total'] else 0
+                for key, s in self.streams.items()
+            },
+        }
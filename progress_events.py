@@ -0,0 +1,46 @@
+# In-process notifications that wake the Server-Sent Events streams watching
+# a task whenever it is written
+
+import queue
+import threading
+from collections import defaultdict
+
+
+class ProgressBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(list)
+
+    def subscribe(self, task_ids, maxsize=64):
+        """Return a queue that receives a notification whenever one of task_ids changes"""
+        q = queue.Queue(maxsize=maxsize)
+        with self._lock:
+            for task_id in task_ids:
+                self._subscribers[task_id].append(q)
+        return q
+
+    def unsubscribe(self, task_ids, q):
+        with self._lock:
+            for task_id in task_ids:
+                subscribers = self._subscribers.get(task_id)
+                if not subscribers:
+                    continue
+                if q in subscribers:
+                    subscribers.remove(q)
+                if not subscribers:
+                    del self._subscribers[task_id]
+
+    def publish(self, task_id, fields):
+        with self._lock:
+            subscribers = list(self._subscribers.get(task_id, ()))
+        for q in subscribers:
+            try:
+                q.put_nowait(fields)
+            except queue.Full:
+                # The stream is behind; it re-reads the task when it catches
+                # up, so dropping an intermediate notification loses nothing
+                pass
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
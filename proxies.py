@@ -0,0 +1,159 @@
+# Proxy pool that scores proxies by success rate and latency, quarantines
+# failing ones with exponential backoff and can probe them in the background
+
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import ytdl
+
+log = logging.getLogger(__name__)
+
+# Error text that points at the proxy or the network rather than the video
+PROXY_ERROR_MARKERS = (
+    'timed out', 'timeout', 'proxy', 'socks', 'connection refused', 'connection reset',
+    'connection aborted', 'network is unreachable', 'no route to host',
+    'remote end closed', 'unable to download webpage', 'http error 429', 'http error 403',
+    'temporary failure in name resolution', 'eof occurred',
+)
+
+
+def proxy_label(proxy):
+    """Printable name of a proxy URL: scheme://host:port, never its credentials"""
+    if not proxy:
+        return 'direct'
+    parsed = urlparse(proxy)
+    if not parsed.hostname:
+        return 'unknown'
+    port = f':{parsed.port}' if parsed.port else ''
+    return f'{parsed.scheme}://{parsed.hostname}{port}'
+
+
+def is_proxy_error(error):
+    """Return True when an extraction/download error looks like a proxy or network failure"""
+    message = str(error).lower()
+    return any(marker in message for marker in PROXY_ERROR_MARKERS)
+
+
+class ProxyStats:
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = None  # Exponentially weighted moving average, seconds
+        self.quarantined_until = 0.0
+
+    def score(self):
+        # Laplace-smoothed success rate, divided by latency so fast proxies
+        # are picked more often; unknown latency counts as average
+        success_rate = (self.successes + 1) / (self.successes + self.failures + 2)
+        latency = self.latency if self.latency is not None else 2.0
+        return success_rate / (0.5 + latency)
+
+
+class ProxyPool:
+    def __init__(self, proxies, groups=None, affinity=None,
+                 quarantine_base=30, quarantine_max=600,
+                 probe_url=None, probe_interval=300, probe_timeout=5):
+        self.proxies = list(proxies)
+        self.groups = groups or {}
+        self.affinity = affinity or {}
+        self.quarantine_base = quarantine_base
+        self.quarantine_max = quarantine_max
+        self.probe_url = probe_url
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self._stats = {proxy: ProxyStats() for proxy in self.proxies}
+        self._lock = threading.Lock()
+        self._prober = None
+
+    def choose(self, platform=None, exclude=()):
+        """Pick a proxy by weighted score, or None if the pool is empty"""
+        self._ensure_prober()
+        now = time.monotonic()
+        with self._lock:
+            candidates = [p for p in self.proxies if p not in exclude]
+            if not candidates:
+                candidates = list(self.proxies)
+            if not candidates:
+                return None
+
+            healthy = [p for p in candidates if self._stats[p].quarantined_until <= now]
+            group = self.groups.get(self.affinity.get(platform), ())
+            preferred = [p for p in healthy if p in group]
+            pool = preferred or healthy
+            if not pool:
+                # Everything is quarantined: use the one that comes back first
+                return min(candidates, key=lambda p: self._stats[p].quarantined_until)
+
+            weights = [self._stats[p].score() for p in pool]
+        return random.choices(pool, weights=weights)[0]
+
+    def report_success(self, proxy, latency=None):
+        stats = self._stats.get(proxy)
+        if stats is None:
+            return
+        with self._lock:
+            stats.successes += 1
+            stats.consecutive_failures = 0
+            stats.quarantined_until = 0.0
+            if latency is not None:
+                stats.latency = latency if stats.latency is None else 0.7 * stats.latency + 0.3 * latency
+
+    def report_failure(self, proxy):
+        stats = self._stats.get(proxy)
+        if stats is None:
+            return
+        with self._lock:
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            backoff = min(self.quarantine_max, self.quarantine_base * 2 ** (stats.consecutive_failures - 1))
+            stats.quarantined_until = time.monotonic() + backoff
+        log.warning("Proxy %s failed %d time(s) in a row; quarantined for %ss",
+                    proxy_label(proxy), stats.consecutive_failures, backoff)
+
+    def _ensure_prober(self):
+        # Started on first use so it runs in the process serving requests
+        if self.probe_url is None or self._prober is not None:
+            return
+        with self._lock:
+            if self._prober is not None:
+                return
+            self._prober = threading.Thread(target=self._probe_loop, name='proxy-prober')
+            self._prober.daemon = True
+            self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            for proxy in list(self.proxies):
+                self.probe(proxy)
+            time.sleep(self.probe_interval)
+
+    def probe(self, proxy):
+        """Fetch the probe URL through a proxy and record the outcome"""
+        started = time.monotonic()
+        try:
+            with ytdl.pool.borrow({'quiet': True, 'proxy': proxy, 'socket_timeout': self.probe_timeout}) as ydl:
+                ydl.urlopen(self.probe_url).read(1024)
+        except Exception:
+            self.report_failure(proxy)
+            return False
+        self.report_success(proxy, time.monotonic() - started)
+        return True
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            # Keyed by label: the proxy URLs can carry credentials
+            return {
+                proxy_label(proxy): {
+                    'successes': s.successes,
+                    'failures': s.failures,
+                    'latency': round(s.latency, 3) if s.latency is not None else None,
+                    'quarantined_for': max(0, round(s.quarantined_until - now)),
+                    'score': round(s.score(), 3),
+                }
+                for proxy, s in self._stats.items()
+            }
@@ -0,0 +1,73 @@
+# Download retry policy: classify a failure by the stage that failed and give
+# every task a fixed number of retries with exponential backoff
+
+import random
+
+from proxies import PROXY_ERROR_MARKERS
+
+NETWORK = 'network'
+EXPIRED = 'expired'
+FORMAT = 'format'
+POSTPROCESS = 'postprocess'
+OUTPUT = 'output'
+FATAL = 'fatal'
+
+# Checked in this order against the lower-cased error text
+FATAL_MARKERS = (
+    'video unavailable', 'private video', 'this video is not available', 'sign in to confirm',
+    'unsupported url', 'has been removed', 'copyright', 'members-only', 'not a valid url',
+    # No retry installs ffmpeg
+    'ffmpeg not found', 'ffmpeg is not installed', 'ffprobe not found',
+)
+FORMAT_MARKERS = ('requested format is not available', 'requested format not available', 'no video formats found')
+# Signed media URLs expire and may be bound to the address that extracted them;
+# some CDNs answer 404 for them. Extracting again tells whether the video is gone.
+EXPIRED_MARKERS = ('http error 403', 'http error 404', 'http error 410')
+NETWORK_MARKERS = PROXY_ERROR_MARKERS + (
+    'incompleteread', 'incomplete read', 'more expected', 'did not get any data blocks',
+    'http error 5', 'unable to download', 'broken pipe', 'read error', 'ssl',
+)
+
+
+class OutputMissing(Exception):
+    """yt-dlp finished but the output file is missing or empty"""
+
+
+def classify(error):
+    """Return the failure kind of an exception raised by a yt-dlp download"""
+    from yt_dlp.utils import ContentTooShortError, PostProcessingError
+    if isinstance(error, OutputMissing):
+        return OUTPUT
+    # DownloadError keeps the exception that caused it
+    cause = (getattr(error, 'exc_info', None) or (None, None))[1]
+    message = str(error).lower()
+    if any(marker in message for marker in FATAL_MARKERS):
+        return FATAL
+    if isinstance(error, PostProcessingError) or isinstance(cause, PostProcessingError) \
+            or 'postprocessing:' in message or 'conversion failed' in message:
+        return POSTPROCESS
+    for kind, markers in ((FORMAT, FORMAT_MARKERS), (EXPIRED, EXPIRED_MARKERS), (NETWORK, NETWORK_MARKERS)):
+        if any(marker in message for marker in markers):
+            return kind
+    if isinstance(cause, (OSError, ContentTooShortError)) or isinstance(error, OSError):
+        return NETWORK
+    return FATAL
+
+
+class RetryBudget:
+    """Retries left for one task and the backoff before each of them"""
+
+    def __init__(self, retries, base_delay, max_delay):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.used = 0
+
+    def next_delay(self):
+        """Use up one retry; return the seconds to wait first, or None when none are left"""
+        if self.used >= self.retries:
+            return None
+        self.used += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.used - 1))
+        # Spread out retries of tasks that failed together
+        return delay * random.uniform(0.8, 1.2)
@@ -0,0 +1,162 @@
+# Sending stored files: Range/If-Range and ETag support over sendfile,
+# front-proxy offload (X-Accel-Redirect / X-Sendfile) and streamed ZIP batches
+
+import mimetypes
+import os
+import unicodedata
+import zipfile
+from urllib.parse import quote
+
+from flask import Response
+from werkzeug.wsgi import FileWrapper
+
+BLOCK_SIZE = 64 * 1024
+
+
+def attachment_header(download_name):
+    """Content-Disposition value that survives non-ASCII titles"""
+    ascii_name = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+    ascii_name = ascii_name.replace('"', '').replace('\\', '')
+    _, ext = os.path.splitext(download_name)
+    return (f"attachment; filename=\"{ascii_name or 'video' + ext}\"; "
+            f"filename*=UTF-8''{quote(download_name)}")
+
+
+def file_etag(st):
+    # Changes whenever the file is replaced or rewritten
+    return f"{st.st_ino:x}-{st.st_size:x}-{int(st.st_mtime * 1000):x}"
+
+
+class ClosingFile:
+    """Read-only file that calls on_close once the server is done with it.
+
+    Exposes fileno() so the WSGI server can still use sendfile().
+    """
+
+    def __init__(self, path, on_close=None):
+        self._file = open(path, 'rb')
+        self._on_close = on_close
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        if self._on_close is not None:
+            self._on_close()
+
+
+def send_file_range(environ, path, download_name, on_close=None):
+    """Serve path as an attachment with conditional and byte-range support.
+
+    on_close runs when the response body has been sent, or right away when
+    no body is sent (HEAD, 304, 412, 416).
+    """
+    try:
+        file = ClosingFile(path, on_close)
+    except OSError:
+        if on_close is not None:
+            on_close()
+        raise
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    # gunicorn's file_wrapper sends the file with sendfile()
+    server_wrapper = environ.get('wsgi.file_wrapper')
+    wrapper = server_wrapper or FileWrapper
+
+    try:
+        st = os.fstat(file.fileno())
+        response = Response(wrapper(file, BLOCK_SIZE), mimetype=mimetype, direct_passthrough=True)
+        response.content_length = st.st_size
+        response.headers['Content-Disposition'] = attachment_header(download_name)
+        response.set_etag(file_etag(st))
+        response.last_modified = st.st_mtime
+        # Let the browser keep the file but check it is still the same one
+        response.cache_control.no_cache = True
+        response.accept_ranges = 'bytes'
+        response.make_conditional(environ, accept_ranges=True, complete_length=st.st_size)
+    except Exception:
+        # Including RequestedRangeNotSatisfiable, which Flask turns into a 416
+        file.close()
+        raise
+
+    if environ['REQUEST_METHOD'] == 'HEAD' or response.status_code not in (200, 206):
+        # No body goes out, so the server never closes the file
+        file.close()
+    elif response.status_code == 206 and server_wrapper is not None:
+        # werkzeug slices the range in Python; hand the server the file
+        # positioned at the start of the range so sendfile() covers it, up
+        # to Content-Length
+        file.seek(response.content_range.start)
+        response.response = wrapper(file, BLOCK_SIZE)
+    return response
+
+
+def send_file_offload(path, download_name, mode, accel_prefix):
+    """Let a front proxy send the file: nginx (X-Accel-Redirect) or
+    Apache/lighttpd (X-Sendfile). The proxy handles ranges and caching."""
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    response = Response(mimetype=mimetype)
+    response.headers['Content-Disposition'] = attachment_header(download_name)
+    if mode == 'x-accel-redirect':
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(os.path.basename(path))
+    else:
+        response.headers['X-Sendfile'] = path
+    return response
+
+
+class _ZipBuffer:
+    """Write-only sink for ZipFile whose contents are drained as they come"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return what was written since the last call, as a list of zero or one chunk"""
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return [data] if data else []
+
+
+def iter_zip(entries):
+    """Yield a ZIP archive of (path, arcname) entries as it is written.
+
+    Videos are already compressed, so members are stored as they are; the
+    archive is never held in memory or on disk as a whole.
+    """
+    sink = _ZipBuffer()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for path, arcname in entries:
+            member = zipfile.ZipInfo.from_file(path, arcname)
+            member.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as src, archive.open(member, 'w', force_zip64=True) as dest:
+                while True:
+                    chunk = src.read(BLOCK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
@@ -0,0 +1,260 @@
+# Disk budget for the downloads directory: expire old files, evict the least
+# recently accessed ones, never touch files that are pinned
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# Leftovers of interrupted yt-dlp downloads and streams
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp')
+
+
+def _is_partial(name):
+    return name.endswith(PARTIAL_SUFFIXES) or '.part-Frag' in name
+
+
+def _owner(name):
+    # Every file of a task starts with its id: <task_id>.mp4,
+    # <task_id>.f137.mp4.part, <task_id>.stream.part
+    return name.split('.', 1)[0]
+
+
+class ArtifactStore:
+    """Byte budget for a downloads directory.
+
+    Finished files are tracked in an in-memory index ordered by last access,
+    with a running byte total, so enforcing the budget after a download
+    costs no directory scan. The directory is scanned once at startup and
+    again every scan_interval seconds, which expires files past their TTL
+    and picks up files written or removed by other worker processes.
+    """
+
+    def __init__(self, directory, budget_bytes, ttl, partial_grace=300, keep=(), scan_interval=300):
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+        self.ttl = ttl
+        # Files written to within this many seconds are in use, possibly by
+        # another worker process, and are left alone
+        self.partial_grace = partial_grace
+        # Bookkeeping files (artifact index, task database) sharing the directory
+        self.keep = tuple(keep)
+        self.scan_interval = scan_interval
+        self._lock = threading.Lock()
+        self._pins = {}
+        # Final output file of each task produced by this process
+        self._outputs = {}
+        # path -> size of every finished file, least recently accessed first
+        self._files = OrderedDict()
+        self._used = 0
+        # Expected size of the downloads in progress, by task id
+        self._reserved = {}
+        self._last_scan = None
+        self.evictions = 0
+        self.expirations = 0
+        self.reclaimed = 0
+        self.bytes_freed = 0
+
+    def pin(self, name):
+        """Protect the files of a task from eviction until unpin() is called.
+
+        name is a task id or the path of one of its files.
+        """
+        owner = _owner(os.path.basename(name))
+        with self._lock:
+            self._pins[owner] = self._pins.get(owner, 0) + 1
+
+    def unpin(self, name):
+        owner = _owner(os.path.basename(name))
+        with self._lock:
+            count = self._pins.get(owner, 0) - 1
+            if count > 0:
+                self._pins[owner] = count
+            else:
+                self._pins.pop(owner, None)
+                # The task is over: its file is indexed or there is none
+                self._reserved.pop(owner, None)
+
+    def record_output(self, task_id, path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = None
+        with self._lock:
+            self._outputs[task_id] = path
+            self._reserved.pop(task_id, None)
+            if size is not None:
+                self._index(path, size)
+
+    def _index(self, path, size):
+        # Caller holds the lock
+        self._used += size - self._files.pop(path, 0)
+        self._files[path] = size
+
+    def _unindex(self, path):
+        # Caller holds the lock
+        self._used -= self._files.pop(path, 0)
+
+    def output_path(self, task_id):
+        """Return the recorded output file of task_id if it still exists, else None"""
+        with self._lock:
+            path = self._outputs.get(task_id)
+        if path is None:
+            return None
+        if not os.path.exists(path):
+            with self._lock:
+                self._outputs.pop(task_id, None)
+                self._unindex(path)
+            return None
+        return path
+
+    def discard(self, task_id):
+        """Delete every file of a task, e.g. the partial files of a cancelled download"""
+        removed = 0
+        for name, path, st in self._scan():
+            if _owner(name) == task_id and self._remove(path, st.st_size, 'reclaimed'):
+                removed += 1
+        with self._lock:
+            self._outputs.pop(task_id, None)
+            self._reserved.pop(task_id, None)
+        return removed
+
+    def touch(self, path):
+        """Mark a file as just accessed.
+
+        The access time is also stored on the file itself so that every
+        worker process gets the same LRU order from its next scan.
+        """
+        try:
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+        except OSError:
+            pass
+        with self._lock:
+            if path in self._files:
+                self._files.move_to_end(path)
+
+    def _scan(self):
+        files = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError as e:
+            log.error("Could not scan %s: %s", self.directory, e)
+            return files
+        for entry in entries:
+            if entry.name.startswith(self.keep):
+                continue
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            files.append((entry.name, entry.path, st))
+        return files
+
+    def _remove(self, path, size, counter):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Already gone, e.g. removed by another worker process
+            with self._lock:
+                self._unindex(path)
+            return False
+        except OSError as e:
+            log.warning("Could not remove %s: %s", path, e)
+            return False
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self.bytes_freed += size
+            self._unindex(path)
+            owner = _owner(os.path.basename(path))
+            if self._outputs.get(owner) == path:
+                del self._outputs[owner]
+        return True
+
+    def _pinned(self, name):
+        with self._lock:
+            return _owner(name) in self._pins
+
+    def rescan(self):
+        """Rebuild the index from the directory, expire files past their TTL
+        and delete partial files nobody has written to for partial_grace
+        seconds (left by failed, crashed or killed tasks)"""
+        now = time.time()
+        finished = []
+        reclaimed = 0
+        for name, path, st in self._scan():
+            if _is_partial(name):
+                # Live ones are covered by their task's reservation
+                if now - st.st_mtime > self.partial_grace and not self._pinned(name):
+                    if self._remove(path, st.st_size, 'reclaimed'):
+                        reclaimed += 1
+                continue
+            if self.ttl and now - st.st_mtime > self.ttl and not self._pinned(name):
+                if self._remove(path, st.st_size, 'expirations'):
+                    continue
+            finished.append((st.st_atime, path, st.st_size))
+        finished.sort()
+        with self._lock:
+            self._files = OrderedDict((path, size) for _, path, size in finished)
+            self._used = sum(size for _, _, size in finished)
+            self._last_scan = time.monotonic()
+        if reclaimed:
+            log.info("Reclaimed %d partial download(s) in %s", reclaimed, self.directory)
+
+    def enforce(self, reserve_bytes=0, owner=None):
+        """Evict least recently used files until the directory plus the
+        downloads in progress fit in the budget.
+
+        reserve_bytes is the expected size of a download about to start;
+        with an owner (task id) it stays reserved until the task records its
+        output or is unpinned.
+        """
+        if self._last_scan is None or time.monotonic() - self._last_scan >= self.scan_interval:
+            self.rescan()
+        with self._lock:
+            if owner is not None:
+                if reserve_bytes:
+                    self._reserved[owner] = reserve_bytes
+                reserve_bytes = 0
+            reserved = reserve_bytes + sum(self._reserved.values())
+            if not self.budget_bytes:
+                return self._used
+
+        tried = set()
+        while True:
+            with self._lock:
+                if self._used + reserved <= self.budget_bytes:
+                    break
+                # Oldest first; pinned and undeletable files are skipped
+                victim = next(((path, size) for path, size in self._files.items()
+                               if path not in tried and _owner(os.path.basename(path)) not in self._pins), None)
+            if victim is None:
+                break
+            tried.add(victim[0])
+            self._remove(victim[0], victim[1], 'evictions')
+        with self._lock:
+            used = self._used
+        if used + reserved > self.budget_bytes:
+            log.warning("Downloads directory over budget: %d bytes used, %d reserved, %d allowed",
+                        used, reserved, self.budget_bytes)
+        return used
+
+    def stats(self):
+        with self._lock:
+            return {
+                'bytes_used': self._used,
+                'bytes_reserved': sum(self._reserved.values()),
+                'budget_bytes': self.budget_bytes,
+                'files': len(self._files),
+                'pinned': len(self._pins),
+                'indexed_outputs': len(self._outputs),
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'reclaimed_partials': self.reclaimed,
+                'bytes_freed': self.bytes_freed,
+                'last_scan_seconds_ago': round(time.monotonic() - self._last_scan) if self._last_scan else None,
+            }
@@ -0,0 +1,158 @@
+# Streaming mode: ffmpeg muxes the selected formats into fragmented MP4 on its
+# stdout, sent to the client as it is produced and teed into a file for reuse
+
+import logging
+import os
+import subprocess
+import threading
+
+import ytdl
+
+log = logging.getLogger(__name__)
+
+# Protocols ffmpeg can read from a plain URL, and those we can feed it
+# ourselves over a pipe
+STREAMABLE_PROTOCOLS = {'http', 'https', 'm3u8', 'm3u8_native'}
+PIPEABLE_PROTOCOLS = {'http', 'https'}
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamingUnavailable(Exception):
+    """The selected formats cannot be muxed on the fly"""
+
+
+def _uses_pipes(proxy):
+    # ffmpeg only speaks HTTP proxies; behind a SOCKS proxy we fetch the
+    # media ourselves through yt-dlp and feed ffmpeg over pipes
+    return bool(proxy) and not proxy.startswith('http')
+
+
+def check_streamable(formats, proxy=None):
+    """Raise StreamingUnavailable if a format's protocol cannot be muxed on the fly"""
+    allowed = PIPEABLE_PROTOCOLS if _uses_pipes(proxy) else STREAMABLE_PROTOCOLS
+    for fmt in formats:
+        if (fmt.get('protocol') or 'https') not in allowed:
+            raise StreamingUnavailable(f"Protocol {fmt.get('protocol')} cannot be streamed")
+
+
+def _format_headers(fmt):
+    headers = fmt.get('http_headers') or {}
+    return ''.join(f"{k}: {v}\r\n" for k, v in headers.items())
+
+
+class MuxStream:
+    """One ffmpeg process muxing the selected formats into fragmented MP4"""
+
+    def __init__(self, formats, part_path, proxy=None, socket_timeout=None):
+        check_streamable(formats, proxy)
+        self.use_pipes = _uses_pipes(proxy)
+        self.formats = formats
+        self.part_path = part_path
+        self.proxy = proxy
+        self.socket_timeout = socket_timeout
+        self.process = None
+        self.bytes_written = 0
+        self._feeders = []
+
+    def _build_command(self, inputs):
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin']
+        for fmt, source in zip(self.formats, inputs):
+            if source.startswith('pipe:'):
+                cmd += ['-i', source]
+                continue
+            headers = _format_headers(fmt)
+            if headers:
+                cmd += ['-headers', headers]
+            if self.proxy:
+                cmd += ['-http_proxy', self.proxy]
+            cmd += ['-i', source]
+
+        if len(self.formats) > 1:
+            # bestvideo+bestaudio: take the video of the first input and the
+            # audio of the second
+            cmd += ['-map', '0:v:0', '-map', '1:a:0']
+        else:
+            cmd += ['-map', '0']
+        cmd += [
+            '-c', 'copy',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-f', 'mp4', 'pipe:1',
+        ]
+        return cmd
+
+    def start(self):
+        inputs, pass_fds, feeds = [], [], []
+        for fmt in self.formats:
+            if self.use_pipes:
+                read_fd, write_fd = os.pipe()
+                inputs.append(f"pipe:{read_fd}")
+                pass_fds.append(read_fd)
+                feeds.append((fmt, write_fd))
+            else:
+                inputs.append(fmt['url'])
+
+        self.process = subprocess.Popen(
+            self._build_command(inputs),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=pass_fds,
+        )
+        for fd in pass_fds:
+            os.close(fd)
+        for fmt, write_fd in feeds:
+            thread = threading.Thread(target=self._feed, args=(fmt, write_fd))
+            thread.daemon = True
+            thread.start()
+            self._feeders.append(thread)
+
+    def _feed(self, fmt, write_fd):
+        ydl_opts = {'quiet': True, 'proxy': self.proxy}
+        if self.socket_timeout:
+            ydl_opts['socket_timeout'] = self.socket_timeout
+        yt_dlp = ytdl.load()
+        from yt_dlp.networking import Request
+        try:
+            with ytdl.pool.borrow(ydl_opts) as ydl, os.fdopen(write_fd, 'wb') as pipe:
+                response = ydl.urlopen(Request(fmt['url'], headers=fmt.get('http_headers') or {}))
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    pipe.write(chunk)
+        except (OSError, yt_dlp.utils.DownloadError, yt_dlp.networking.exceptions.RequestError) as e:
+            # A broken pipe means ffmpeg went away; anything else makes
+            # ffmpeg fail on a truncated input, which is reported there
+            log.warning("Stopped feeding format %s: %s", fmt.get('format_id'), e)
+
+    def iter_chunks(self):
+        """Yield muxed bytes while writing them to part_path.
+
+        Returns normally only when ffmpeg finished successfully; the part
+        file is then complete.
+        """
+        if self.process is None:
+            self.start()
+        try:
+            with open(self.part_path, 'wb') as part:
+                while True:
+                    chunk = self.process.stdout.read1(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    part.write(chunk)
+                    self.bytes_written += len(chunk)
+                    yield chunk
+            returncode = self.process.wait()
+            if returncode != 0:
+                error = self.process.stderr.read().decode('utf-8', 'replace').strip()
+                raise RuntimeError(f"ffmpeg exited with {returncode}: {error[-500:]}")
+        finally:
+            self.close()
+
+    def close(self):
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        if self.process:
+            self.process.stdout.close()
+            self.process.stderr.close()
@@ -0,0 +1,226 @@
+# Task state storage: an in-memory backend for a single process and a SQLite
+# (WAL) backend shared by every gunicorn worker, both with expiry and a size bound
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# Tasks in these states will not change any more and may be dropped first
+FINAL_STATUSES = ('finished', 'error', 'cancelled')
+
+
+class TaskStore(ABC):
+    """Interface for task state backends. Tasks are plain JSON-able dicts."""
+
+    @abstractmethod
+    def create(self, task_id, fields):
+        """Store a new task, replacing any task with the same id"""
+
+    @abstractmethod
+    def get(self, task_id):
+        """Return a copy of the task dict, or None if it does not exist"""
+
+    @abstractmethod
+    def update(self, task_id, **fields):
+        """Merge fields into an existing task. Unknown tasks are ignored."""
+
+    @abstractmethod
+    def delete(self, task_id):
+        """Remove a task; unknown tasks are ignored"""
+
+    def __contains__(self, task_id):
+        return self.get(task_id) is not None
+
+
+class TaskRecord:
+    """One task in the memory store.
+
+    The fields every task has live in slots; the rest (progress details,
+    codecs, batch items) go into a dict that only exists when needed.
+    """
+
+    __slots__ = ('status', 'progress', 'title', 'filename', 'error', 'extra', 'updated')
+    FIELDS = ('status', 'progress', 'title', 'filename', 'error')
+
+    def __init__(self, fields, now):
+        self.status = self.progress = self.title = self.filename = self.error = None
+        self.extra = None
+        self.updated = now
+        self.update(fields, now)
+
+    def update(self, fields, now):
+        for key, value in fields.items():
+            if key in self.FIELDS:
+                setattr(self, key, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+        self.updated = now
+
+    def to_dict(self):
+        task = {key: getattr(self, key) for key in self.FIELDS if getattr(self, key) is not None}
+        if self.extra:
+            task.update(self.extra)
+        return task
+
+
+class MemoryTaskStore(TaskStore):
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Least recently updated first
+        self._tasks = OrderedDict()
+        self._lock = threading.Lock()
+        self.expired = 0
+
+    def _prune(self, now):
+        # Tasks nobody has touched for ttl seconds are gone, whatever state
+        # they are in (a client that waited that long has left)
+        if self.ttl:
+            while self._tasks:
+                task_id, record = next(iter(self._tasks.items()))
+                if now - record.updated <= self.ttl:
+                    break
+                del self._tasks[task_id]
+                self.expired += 1
+        if self.max_entries and len(self._tasks) > self.max_entries:
+            excess = len(self._tasks) - self.max_entries
+            victims = []
+            for task_id, record in self._tasks.items():
+                if record.status in FINAL_STATUSES:
+                    victims.append(task_id)
+                    if len(victims) == excess:
+                        break
+            for task_id in victims:
+                del self._tasks[task_id]
+            self.expired += len(victims)
+
+    def create(self, task_id, fields):
+        now = time.time()
+        with self._lock:
+            self._tasks[task_id] = TaskRecord(fields, now)
+            self._tasks.move_to_end(task_id)
+            self._prune(now)
+
+    def get(self, task_id):
+        with self._lock:
+            record = self._tasks.get(task_id)
+            return record.to_dict() if record is not None else None
+
+    def update(self, task_id, **fields):
+        with self._lock:
+            record = self._tasks.get(task_id)
+            if record is not None:
+                record.update(fields, time.time())
+                self._tasks.move_to_end(task_id)
+
+    def delete(self, task_id):
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tasks)
+
+
+class SQLiteTaskStore(TaskStore):
+    # Expiry runs on at most one create in this many
+    PRUNE_EVERY = 50
+
+    def __init__(self, path, ttl=None, max_entries=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._creates = 0
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            'task_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS tasks_updated ON tasks (updated)')
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads; each thread
+        # (and each forked worker process) opens its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, task_id, fields):
+        now = time.time()
+        self._connection().execute(
+            'INSERT OR REPLACE INTO tasks (task_id, data, updated) VALUES (?, ?, ?)',
+            (task_id, json.dumps(fields), now),
+        )
+        self._creates += 1
+        if self._creates % self.PRUNE_EVERY == 0:
+            self.prune(now)
+
+    def prune(self, now=None):
+        """Delete expired tasks, then the oldest finished ones beyond max_entries"""
+        now = now or time.time()
+        conn = self._connection()
+        if self.ttl:
+            conn.execute('DELETE FROM tasks WHERE updated < ?', (now - self.ttl,))
+        if self.max_entries:
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                placeholders = ', '.join('?' for _ in FINAL_STATUSES)
+                conn.execute(
+                    'DELETE FROM tasks WHERE task_id IN ('
+                    'SELECT task_id FROM tasks '
+                    f"WHERE json_extract(data, '$.status') IN ({placeholders}) "
+                    'ORDER BY updated LIMIT ?)',
+                    (*FINAL_STATUSES, excess),
+                )
+
+    def get(self, task_id):
+        row = self._connection().execute(
+            'SELECT data FROM tasks WHERE task_id = ?', (task_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, task_id, **fields):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+            if row is not None:
+                task = json.loads(row[0])
+                task.update(fields)
+                conn.execute(
+                    'UPDATE tasks SET data = ?, updated = ? WHERE task_id = ?',
+                    (json.dumps(task), time.time(), task_id),
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, task_id):
+        self._connection().execute('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+
+def create_task_store(backend, path=None, ttl=None, max_entries=None):
+    """Build the task store named in config.TASK_STORE"""
+    if backend == 'memory':
+        return MemoryTaskStore(ttl, max_entries)
+    if backend == 'sqlite':
+        return SQLiteTaskStore(path, ttl, max_entries)
+    raise ValueError(f"Unknown task store backend: {backend}")
@@ -0,0 +1,110 @@
+# Lazy loading of yt-dlp, one-time ffmpeg detection and a pool of reusable
+# YoutubeDL instances keyed by their options
+
+import contextlib
+import functools
+import shutil
+import threading
+from collections import OrderedDict
+
+
+def load():
+    """Import yt_dlp on first use and return the module"""
+    import yt_dlp
+    return yt_dlp
+
+
+def preload():
+    """Do the one-time work up front: import yt-dlp with its extractor list and
+    detect ffmpeg. Called in the gunicorn master before it forks workers."""
+    load()
+    from yt_dlp.extractor import gen_extractor_classes
+    gen_extractor_classes()
+    return ffmpeg_info()
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_info():
+    """Return the ffmpeg/ffprobe versions, checked once per process.
+
+    Going through yt-dlp also fills its own version cache, so its
+    post-processors do not run 'ffmpeg -version' again.
+    """
+    load()
+    from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessor
+    versions = FFmpegPostProcessor.get_versions()
+    return {
+        'available': bool(versions.get('ffmpeg')),
+        'path': shutil.which('ffmpeg'),
+        'ffmpeg': versions.get('ffmpeg'),
+        'ffprobe': versions.get('ffprobe'),
+    }
+
+
+def _profile(opts):
+    return tuple(sorted((key, repr(value)) for key, value in opts.items()))
+
+
+class YoutubeDLPool:
+    """Idle YoutubeDL instances keyed by their options.
+
+    A YoutubeDL is not safe to share between threads, so each one is lent to
+    one caller at a time. Options must not hold per-call state (hooks,
+    output templates); downloads still build their own instance.
+    """
+
+    def __init__(self, max_idle=4, max_profiles=32):
+        self.max_idle = max_idle
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        self._idle = OrderedDict()
+        self.created = 0
+        self.reused = 0
+
+    @contextlib.contextmanager
+    def borrow(self, opts):
+        key = _profile(opts)
+        ydl = None
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                ydl = idle.pop()
+                self._idle.move_to_end(key)
+                self.reused += 1
+            else:
+                self.created += 1
+        if ydl is None:
+            ydl = load().YoutubeDL(dict(opts))
+        try:
+            yield ydl
+        finally:
+            self._give_back(key, ydl)
+
+    def _give_back(self, key, ydl):
+        evicted = []
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(idle) < self.max_idle:
+                idle.append(ydl)
+                ydl = None
+            # Arbitrary format selectors make arbitrary profiles; keep the
+            # most recently used ones
+            while len(self._idle) > self.max_profiles:
+                _, dropped = self._idle.popitem(last=False)
+                evicted.extend(dropped)
+        for instance in evicted + ([ydl] if ydl is not None else []):
+            instance.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'profiles': len(self._idle),
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'created': self.created,
+                'reused': self.reused,
+            }
+
+
+# Shared by every module of this process
+pool = YoutubeDLPool()